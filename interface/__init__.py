@@ -1 +1 @@
-app_name = "interface"
+default_app_config = 'interface.apps.InterfaceConfig'
@@ -1,8 +1,90 @@
 from django.contrib import admin
+from django.core.paginator import Paginator
+from django.db import connections
+from django.utils.functional import cached_property
 
 from interface import models
 
-admin.site.register(models.Brand)
-admin.site.register(models.Product)
-admin.site.register(models.Packaging)
-admin.site.register(models.GenericProduct)
+
+class EstimatedCountPaginator(Paginator):
+    """
+    Paginator that estimates the count of unfiltered large tables.
+
+    Counting all rows of a large table is slow, so this uses the planner
+    statistics on PostgreSQL and the highest primary key on SQLite.
+    Filtered querysets, e.g. search results, are still counted exactly.
+    """
+
+    #: Estimates below this are replaced by exact counts
+    threshold = 10000
+
+    def _estimate(self):
+        queryset = self.object_list
+        if queryset.query.where:
+            return None
+        connection = connections[queryset.db]
+        model = queryset.model
+        if connection.vendor == 'postgresql':
+            with connection.cursor() as cursor:
+                cursor.execute(
+                    "SELECT reltuples FROM pg_class WHERE relname = %s",
+                    [model._meta.db_table])
+                row = cursor.fetchone()
+            return int(row[0]) if row is not None else None
+        if connection.vendor == 'sqlite':
+            return (model._default_manager.using(queryset.db)
+                    .order_by('-pk').values_list('pk', flat=True).first())
+        return None
+
+    @cached_property
+    def count(self):
+        estimate = self._estimate()
+        if estimate is not None and estimate >= self.threshold:
+            return estimate
+        return super().count
+
+
+class LargeTableAdmin(admin.ModelAdmin):
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+
+
+@admin.register(models.Brand)
+class BrandAdmin(LargeTableAdmin):
+    search_fields = ['^name']
+
+
+@admin.register(models.Product)
+class ProductAdmin(LargeTableAdmin):
+    list_display = ['name', 'brand', 'generic_product', 'live_count',
+                    'count_shards']
+    list_select_related = ['brand', 'generic_product']
+    autocomplete_fields = ['brand', 'generic_product']
+    search_fields = ['^name', '^brand__name']
+    # The count is maintained by scanning, see StockMovement
+    exclude = ['count']
+    readonly_fields = ['live_count']
+
+    def get_queryset(self, request):
+        return models.Product.with_live_count(super().get_queryset(request))
+
+    def live_count(self, obj):
+        return obj.live_count
+    live_count.short_description = 'count'
+    live_count.admin_order_field = 'live_count'
+
+
+@admin.register(models.Packaging)
+class PackagingAdmin(LargeTableAdmin):
+    list_display = ['label', 'product', 'count', 'description']
+    list_select_related = ['product__brand']
+    autocomplete_fields = ['product']
+    search_fields = ['=label', '^product__name']
+
+
+@admin.register(models.GenericProduct)
+class GenericProductAdmin(LargeTableAdmin):
+    list_display = ['name', 'stock', 'reorder_level']
+    search_fields = ['^name']
+    # The stock is maintained from the products, see GenericProduct.stock
+    readonly_fields = ['stock']
@@ -3,3 +3,6 @@ from django.apps import AppConfig
 
 class InterfaceConfig(AppConfig):
     name = 'interface'
+
+    def ready(self):
+        from interface import signals  # noqa: F401
@@ -0,0 +1,253 @@
+import threading
+import time
+from collections import OrderedDict, namedtuple
+
+from django.conf import settings
+from django.core.cache import caches
+
+from interface.models import Packaging
+
+#: What an EAN resolves to: primary keys, the number of products in it and
+#: the :attr:`~interface.models.Product.count_shards` of the product
+Resolution = namedtuple('Resolution',
+                        ['packaging', 'product', 'count', 'shards'],
+                        defaults=(0,))
+
+
+class EANCache:
+    """
+    Cache of EAN → :class:`Resolution`.
+
+    By default this is a bounded in-process LRU cache. If ``backend`` names
+    one of the ``CACHES``, that cache is used instead, so the entries are
+    shared between processes and invalidations are seen by all of them.
+
+    Entries are invalidated by the signal handlers in
+    :mod:`interface.signals` once the change is committed. Other processes
+    don't see the invalidations of an in-process cache, so entries expire
+    after ``ttl`` seconds. Views that change counts resolve with
+    ``fresh=True``.
+    """
+
+    key_prefix = 'interface:ean:'
+
+    def __init__(self, maxsize=4096, backend=None, ttl=60):
+        self.maxsize = maxsize
+        self.backend = backend
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_settings(cls):
+        return cls(
+            maxsize=getattr(settings, 'INTERFACE_EAN_CACHE_SIZE', 4096),
+            backend=getattr(settings, 'INTERFACE_EAN_CACHE_BACKEND', None),
+            ttl=getattr(settings, 'INTERFACE_EAN_CACHE_TTL', 60),
+        )
+
+    def _shared(self):
+        return caches[self.backend]
+
+    def get(self, ean):
+        """Look up ``ean`` without touching the database"""
+        if self.backend is not None:
+            value = self._shared().get(self.key_prefix + ean)
+            result = Resolution(*value) if value is not None else None
+            with self._lock:
+                if result is None:
+                    self.misses += 1
+                else:
+                    self.hits += 1
+            return result
+
+        with self._lock:
+            try:
+                (result, expires) = self._entries[ean]
+            except KeyError:
+                self.misses += 1
+                return None
+            if expires < time.monotonic():
+                del self._entries[ean]
+                self.misses += 1
+                return None
+            self._entries.move_to_end(ean)
+            self.hits += 1
+            return result
+
+    def set(self, ean, resolution):
+        if self.backend is not None:
+            self._shared().set(self.key_prefix + ean, tuple(resolution),
+                               self.ttl)
+            return
+
+        with self._lock:
+            self._entries[ean] = (resolution, time.monotonic() + self.ttl)
+            self._entries.move_to_end(ean)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def resolve(self, ean, fresh=False):
+        """
+        Resolve ``ean`` to a :class:`Resolution`, from the database if
+        ``fresh`` is true.
+
+        Raises :class:`~interface.models.Packaging.DoesNotExist` for unknown
+        EANs.
+        """
+        result = None if fresh else self.get(ean)
+        if result is None:
+            result = Resolution(*Packaging.objects.values_list(
+                'pk', 'product', 'count', 'product__count_shards')
+                .get(label=ean))
+            self.set(ean, result)
+        return result
+
+    def invalidate(self, ean):
+        if self.backend is not None:
+            self._shared().delete(self.key_prefix + ean)
+            return
+
+        with self._lock:
+            self._entries.pop(ean, None)
+
+    def invalidate_product(self, product, eans=()):
+        """Drop all entries of ``product``, or at least ``eans``"""
+        if self.backend is not None:
+            self._shared().delete_many(
+                [self.key_prefix + ean for ean in eans])
+            return
+
+        with self._lock:
+            for ean in [ean for (ean, (result, _)) in self._entries.items()
+                        if result.product == product]:
+                del self._entries[ean]
+
+    def clear(self):
+        if self.backend is None:
+            with self._lock:
+                self._entries.clear()
+        with self._lock:
+            self.hits = self.misses = 0
+
+    def stats(self):
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'size': len(self._entries),
+                'maxsize': self.maxsize,
+            }
+
+
+#: Cached autocomplete results, and whether they are all results
+_Results = namedtuple('_Results', ['version', 'expires', 'objects',
+                                   'complete'])
+
+
+class AutocompleteCache:
+    """
+    Short-lived in-process cache of autocomplete results.
+
+    Results are stored per ``(scope, query)``, where the scope is the view
+    and its forwarded values. If the results of a shorter prefix of a query
+    are cached and complete, the query is answered by filtering those in
+    memory, so typing "koff" only queries the database for "k" or "ko".
+
+    Entries are only used for the catalog version they were stored for, so
+    a change in any process invalidates them. The cache holds at most
+    ``maxsize`` entries of at most ``fetch_limit`` objects each.
+    """
+
+    def __init__(self, maxsize=256, ttl=30, fetch_limit=100):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.fetch_limit = fetch_limit
+        self.hits = 0
+        self.narrowed = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_settings(cls):
+        return cls(
+            maxsize=getattr(settings, 'INTERFACE_AUTOCOMPLETE_CACHE_SIZE',
+                            256),
+            ttl=getattr(settings, 'INTERFACE_AUTOCOMPLETE_CACHE_TTL', 30),
+        )
+
+    def _get(self, key, version, now):
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        if entry.version != version or entry.expires < now:
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return entry
+
+    def _set(self, key, entry):
+        self._entries[key] = entry
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+
+    def results(self, scope, query, version, search, matches, limit):
+        """
+        The first ``limit`` results for ``query``.
+
+        ``search(query, limit)`` finds the best matches in the database, and
+        ``matches(query, obj)`` checks in memory whether ``search`` would
+        have found ``obj``. Narrowed results keep the order of the results
+        they were filtered from.
+        """
+        query = query.lower()
+        now = time.monotonic()
+        with self._lock:
+            entry = self._get((scope, query), version, now)
+            if entry is not None:
+                self.hits += 1
+                return entry.objects[:limit]
+            for end in range(len(query) - 1, 0, -1):
+                entry = self._get((scope, query[:end]), version, now)
+                if entry is not None and entry.complete:
+                    break
+            else:
+                entry = None
+
+        if entry is not None:
+            objects = [obj for obj in entry.objects if matches(query, obj)]
+            complete = True
+            counter = 'narrowed'
+        else:
+            objects = list(search(query, self.fetch_limit))
+            complete = len(objects) < self.fetch_limit
+            counter = 'misses'
+
+        with self._lock:
+            setattr(self, counter, getattr(self, counter) + 1)
+            self._set((scope, query),
+                      _Results(version, now + self.ttl, objects, complete))
+        return objects[:limit]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.hits = self.narrowed = self.misses = 0
+
+    def stats(self):
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'narrowed': self.narrowed,
+                'misses': self.misses,
+                'size': len(self._entries),
+                'maxsize': self.maxsize,
+            }
+
+
+ean_cache = EANCache.from_settings()
+autocomplete_cache = AutocompleteCache.from_settings()
@@ -0,0 +1,337 @@
+"""
+Bulk import and export of the catalog.
+
+Imported rows are dicts with the keys ``ean``, ``brand``, ``product``,
+``generic_product`` (optional) and ``count`` (optional, number of products
+per package). They are processed in chunks, each in its own transaction,
+so memory use does not grow with the size of the catalog.
+
+Exported rows are products with their brand, generic product, count and
+the EANs of all their packagings.
+
+Scanner clients keep a copy of the catalog with :func:`changes`, which
+returns the brands, products and packagings that changed since a
+:class:`~interface.models.CatalogVersion`.
+"""
+import csv
+import itertools
+import json
+from collections import namedtuple
+
+from django.db import transaction
+from django.db.models import Aggregate, CharField
+
+from interface import ean as ean_codec
+from interface import search
+from interface.models import (Brand, BrandPrefix, CatalogDeletion,
+                              CatalogVersion, GenericProduct, Packaging,
+                              Product)
+
+#: Columns of a catalog file
+COLUMNS = ('ean', 'brand', 'product', 'generic_product', 'count')
+
+#: Upper bound of :attr:`Packaging.count`
+MAX_COUNT = 32767
+
+#: Maximum length of :attr:`Packaging.label`
+LABEL_LENGTH = Packaging._meta.get_field('label').max_length
+
+#: A checked row
+CatalogRow = namedtuple('CatalogRow', [
+    'number', 'data', 'ean', 'brand', 'product', 'generic_product', 'count'])
+
+
+def read_csv(f):
+    return csv.DictReader(f)
+
+
+def read_jsonl(f):
+    for line in f:
+        if line.strip():
+            yield json.loads(line)
+
+
+class Rejection:
+    """A row that could not be imported, ``number`` counts from 1"""
+
+    def __init__(self, number, row, reason):
+        self.number = number
+        self.row = row
+        self.reason = reason
+
+    def __str__(self):
+        return f"row {self.number}: {self.reason}"
+
+
+class CatalogImporter:
+    """
+    Import catalog rows in chunks.
+
+    The brand and generic product names seen so far are kept in memory, so
+    each name is looked up or created only once.
+    """
+
+    def __init__(self, chunk_size=500):
+        self.chunk_size = chunk_size
+        self.brands = {}
+        self.generic_products = {}
+        self.imported = 0
+        self.catalog_version = None
+
+    def run(self, rows):
+        """Import ``rows`` and yield a :class:`Rejection` for bad rows"""
+        rows = enumerate(rows, start=1)
+        while True:
+            chunk = list(itertools.islice(rows, self.chunk_size))
+            if not chunk:
+                return
+            with transaction.atomic():
+                yield from self._import_chunk(chunk)
+
+    def _clean(self, chunk):
+        """Check the fields of the rows and validate all EANs at once"""
+        valid, invalid = ean_codec.validate_many(
+            [str(row.get('ean') or '') for (_, row) in chunk])
+        for (index, error) in invalid:
+            number, row = chunk[index]
+            yield None, Rejection(number, row, f"bad EAN: {error.message}")
+
+        for (index, ean) in valid:
+            number, row = chunk[index]
+            brand = (row.get('brand') or '').strip()
+            product = (row.get('product') or '').strip()
+            generic = (row.get('generic_product') or '').strip()
+            try:
+                count = int(row.get('count') or 1)
+            except (TypeError, ValueError):
+                count = 0
+            if len(ean) > LABEL_LENGTH:
+                yield None, Rejection(number, row, f"EAN {ean} is too long")
+            elif not brand or not product:
+                yield None, Rejection(number, row, "missing brand or product")
+            elif not 1 <= count <= MAX_COUNT:
+                yield None, Rejection(
+                    number, row, f"bad count: {row.get('count')!r}")
+            else:
+                yield CatalogRow(number, row, ean, brand, product, generic,
+                                 count), None
+
+    def _resolve_names(self, model, names, cache, create=True):
+        """Look up or create objects by name, filling ``cache``"""
+        missing = set(names) - cache.keys()
+        if not missing:
+            return
+        for (pk, name) in (model.objects.filter(name__in=missing)
+                           .order_by('-pk').values_list('pk', 'name')):
+            cache[name] = pk
+        if not create:
+            return
+        created = [model(name=name) for name in missing - cache.keys()]
+        if not created:
+            return
+        if model is Brand:
+            for brand in created:
+                brand.catalog_version = self.catalog_version
+        model.objects.bulk_create(created)
+        for (pk, name) in (model.objects.filter(
+                name__in=[obj.name for obj in created])
+                .order_by('-pk').values_list('pk', 'name')):
+            cache[name] = pk
+        if model is GenericProduct:
+            search.index_generic_products(
+                [cache[obj.name] for obj in created])
+
+    def _import_chunk(self, chunk):
+        rows = []
+        for (row, rejection) in self._clean(chunk):
+            if rejection is not None:
+                yield rejection
+            else:
+                rows.append(row)
+        if not rows:
+            return
+
+        existing = set(Packaging.objects.filter(
+            label__in=[row.ean for row in rows]
+        ).values_list('label', flat=True))
+        self._resolve_names(Brand, {row.brand for row in rows}, self.brands,
+                            create=False)
+
+        # Check the brand identifiers once for the whole chunk
+        prefix_brands = {}
+        for (prefix, brand) in BrandPrefix.objects.filter(
+                prefix__in={Brand.get_brand_identifier(row.ean)
+                            for row in rows}
+        ).values_list('prefix', 'brand'):
+            prefix_brands.setdefault(prefix, set()).add(brand)
+
+        accepted = []
+        for row in rows:
+            # Brands that don't exist yet are only created if a row is valid
+            brand = self.brands.get(row.brand, row.brand)
+            if row.ean in existing:
+                yield Rejection(row.number, row.data,
+                                f"EAN {row.ean} already exists")
+                continue
+            brands = prefix_brands.setdefault(
+                Brand.get_brand_identifier(row.ean), set())
+            if brands and brands != {brand}:
+                yield Rejection(
+                    row.number, row.data,
+                    f"EAN {row.ean} belongs to another brand than "
+                    f"{row.brand}")
+                continue
+            brands.add(brand)
+            existing.add(row.ean)
+            accepted.append(row)
+        if not accepted:
+            return
+
+        # All changes of the chunk get the same version, see CatalogVersion
+        self.catalog_version = CatalogVersion.next()
+        self._resolve_names(Brand, {row.brand for row in accepted},
+                            self.brands)
+        self._resolve_names(
+            GenericProduct,
+            {row.generic_product for row in accepted if row.generic_product},
+            self.generic_products)
+        products = self._resolve_products(accepted)
+
+        Packaging.objects.bulk_create([
+            Packaging(label=row.ean, count=row.count,
+                      product_id=products[(self.brands[row.brand],
+                                           row.product)],
+                      catalog_version=self.catalog_version)
+            for row in accepted
+        ])
+        BrandPrefix.objects.bulk_create([
+            BrandPrefix(prefix=prefix, brand_id=brand)
+            for (prefix, brand) in {
+                (Brand.get_brand_identifier(row.ean), self.brands[row.brand])
+                for row in accepted
+            }
+        ], ignore_conflicts=True)
+        self.imported += len(accepted)
+
+    def _resolve_products(self, rows):
+        """Map ``(brand pk, product name)`` to products, creating them"""
+        keys = {(self.brands[row.brand], row.product): row for row in rows}
+
+        def lookup():
+            return {
+                (brand, name): pk
+                for (pk, brand, name) in Product.objects.filter(
+                    brand__in={brand for (brand, _) in keys},
+                    name__in={name for (_, name) in keys},
+                ).order_by('-pk').values_list('pk', 'brand', 'name')
+                if (brand, name) in keys
+            }
+
+        products = lookup()
+        missing = keys.keys() - products.keys()
+        if missing:
+            Product.objects.bulk_create([
+                Product(brand_id=brand, name=name,
+                        generic_product_id=self.generic_products.get(
+                            keys[(brand, name)].generic_product),
+                        catalog_version=self.catalog_version)
+                for (brand, name) in missing
+            ])
+            products = lookup()
+            search.index_products([products[key] for key in missing])
+        return products
+
+
+#: Columns of an export
+EXPORT_COLUMNS = ('brand', 'product', 'generic_product', 'count', 'eans')
+
+
+class EANList(Aggregate):
+    """Space-separated list of EANs"""
+    function = 'GROUP_CONCAT'
+    template = "%(function)s(%(expressions)s, ' ')"
+    output_field = CharField()
+
+    def as_postgresql(self, compiler, connection, **extra_context):
+        return self.as_sql(compiler, connection, function='STRING_AGG',
+                           **extra_context)
+
+
+def export_rows(chunk_size=2000):
+    """Yield a tuple of :data:`EXPORT_COLUMNS` per product"""
+    queryset = (Product.with_live_count()
+                .annotate(eans=EANList('packaging__label'))
+                .order_by('pk')
+                .values_list('brand__name', 'name', 'generic_product__name',
+                             'live_count', 'eans'))
+    for (brand, name, generic, count, eans) in queryset.iterator(
+            chunk_size=chunk_size):
+        yield (brand, name, generic or '', count,
+               eans.split() if eans else [])
+
+
+class _Echo:
+    """File-like object that returns what is written to it"""
+
+    def write(self, value):
+        return value
+
+
+def export_csv(rows):
+    """Yield lines of CSV, the EANs separated by spaces"""
+    writer = csv.writer(_Echo())
+    yield writer.writerow(EXPORT_COLUMNS)
+    for row in rows:
+        yield writer.writerow(row[:-1] + (' '.join(row[-1]),))
+
+
+def export_jsonl(rows):
+    """Yield lines of JSON objects"""
+    for row in rows:
+        yield json.dumps(dict(zip(EXPORT_COLUMNS, row))) + '\n'
+
+
+EXPORT_FORMATS = {
+    'csv': (export_csv, 'text/csv'),
+    'jsonl': (export_jsonl, 'application/x-ndjson'),
+}
+
+
+def changes(since=None):
+    """
+    Everything that changed in the catalog after version ``since``, or the
+    whole catalog if ``since`` is ``None`` or unknown.
+
+    Rows are lists to keep the response small: brands are ``[pk, name]``,
+    products ``[pk, brand, name]`` and packagings ``[pk, ean, product,
+    count]``. Deleted objects are listed by pk.
+    """
+    # Versions up to the committed counter are complete, later ones may
+    # still be in a transaction
+    version = CatalogVersion.current()
+    full = since is None or since > version
+
+    def changed(model):
+        queryset = model.objects.all()
+        if not full:
+            queryset = queryset.filter(catalog_version__gt=since,
+                                       catalog_version__lte=version)
+        return queryset.order_by('pk')
+
+    deleted = {kind: [] for (kind, _) in CatalogDeletion.KIND_CHOICES}
+    if not full:
+        for (kind, pk) in CatalogDeletion.objects.filter(
+                catalog_version__gt=since, catalog_version__lte=version
+        ).order_by('catalog_version').values_list('kind', 'object_id'):
+            deleted[kind].append(pk)
+
+    return {
+        'version': version,
+        'full': full,
+        'brands': list(map(list, changed(Brand).values_list('pk', 'name'))),
+        'products': list(map(list, changed(Product).values_list(
+            'pk', 'brand', 'name'))),
+        'packagings': list(map(list, changed(Packaging).values_list(
+            'pk', 'label', 'product', 'count'))),
+        'deleted': deleted,
+    }
@@ -0,0 +1,260 @@
+"""
+Decode EAN-13 and EAN-8 barcodes from photos, without a browser.
+
+Every image is scaled down, and a number of horizontal and vertical
+scanlines are binarized and run-length encoded with NumPy. All windows of
+runs that could be a barcode are then checked at once: the guard patterns,
+the nearest digit pattern of every group of four runs and finally the check
+digit.
+
+This needs NumPy and Pillow, which are not installed by default: ``pip
+install numpy Pillow``. Use :func:`decode_many` to spread many images over a
+pool of worker processes.
+"""
+import io
+import itertools
+import threading
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
+
+from interface import ean as ean_codec
+
+try:
+    import numpy as np
+    from PIL import Image
+except ImportError:
+    np = Image = None
+
+#: Whether NumPy and Pillow are installed
+AVAILABLE = np is not None
+
+#: Images are scaled down to fit in a square of this size
+MAX_SIZE = 1280
+
+#: Number of horizontal and of vertical scanlines per image
+SCANLINES = 24
+
+#: A pixel is dark if it is darker than this fraction of the mean of the
+#: pixels around it
+DARK_THRESHOLD = 0.9
+
+#: Minimal width of the quiet zone before a barcode, in modules
+QUIET_ZONE = 3
+
+#: Maximal deviation of a guard bar or space from one module
+GUARD_TOLERANCE = 0.5
+
+#: Maximal squared distance of a digit to its nearest pattern
+MAX_DISTANCE = 1.0
+
+#: Run lengths of the L-code of the digits 0-9, starting with a space.
+#: R-code digits have the same run lengths, starting with a bar.
+L_WIDTHS = (
+    (3, 2, 1, 1), (2, 2, 2, 1), (2, 1, 2, 2), (1, 4, 1, 1), (1, 1, 3, 2),
+    (1, 2, 3, 1), (1, 1, 1, 4), (1, 3, 1, 2), (1, 2, 1, 3), (3, 1, 1, 2),
+)
+
+#: Run lengths of the G-code, the mirrored R-code
+G_WIDTHS = tuple(tuple(reversed(widths)) for widths in L_WIDTHS)
+
+#: The first digit of an EAN-13 from the parity of the next six digits
+FIRST_DIGITS = {
+    'LLLLLL': '0', 'LLGLGG': '1', 'LLGGLG': '2', 'LLGGGL': '3',
+    'LGLLGG': '4', 'LGGLLG': '5', 'LGGGLL': '6', 'LGLGLG': '7',
+    'LGLGGL': '8', 'LGGLGL': '9',
+}
+
+#: ``(number of digits, number of modules)`` of EAN-13 and EAN-8
+LAYOUTS = ((12, 95), (8, 67))
+
+
+@lru_cache()
+def _patterns():
+    return (np.array(L_WIDTHS + G_WIDTHS, dtype=np.float32),
+            np.array(L_WIDTHS, dtype=np.float32))
+
+
+def _scanlines(pixels):
+    """Evenly spaced rows of ``pixels``, each averaged with its neighbours"""
+    height = pixels.shape[0]
+    rows = np.linspace(1, height - 2, SCANLINES).astype(int)
+    return (pixels[rows - 1] + pixels[rows] + pixels[rows + 1]) / 3
+
+
+def _binarize(lines):
+    """Find the dark pixels of all lines, with an adaptive threshold"""
+    width = lines.shape[1]
+    half = max(width // 16, 1)
+    sums = np.cumsum(np.pad(lines, ((0, 0), (1, 0)), mode='constant'),
+                     axis=1)
+    positions = np.arange(width)
+    low = np.clip(positions - half, 0, width)
+    high = np.clip(positions + half + 1, 0, width)
+    means = (sums[:, high] - sums[:, low]) / (high - low)
+    return lines < means * DARK_THRESHOLD
+
+
+def _runs(dark):
+    """Run lengths of a line, and whether the first run is dark"""
+    edges = np.flatnonzero(dark[1:] != dark[:-1]) + 1
+    bounds = np.concatenate(([0], edges, [len(dark)]))
+    return np.diff(bounds).astype(np.float32), bool(dark[0])
+
+
+def _windows(runs, length):
+    """All ``length`` consecutive runs, without copying"""
+    stride = runs.strides[0]
+    return np.lib.stride_tricks.as_strided(
+        runs, shape=(len(runs) - length + 1, length),
+        strides=(stride, stride), writeable=False)
+
+
+def _match(groups, patterns):
+    """
+    Find the nearest pattern for every group of four runs.
+
+    Returns the indices of the patterns, and per window whether all its
+    groups were close enough to a pattern.
+    """
+    groups = groups * 7 / groups.sum(axis=2, keepdims=True)
+    distances = ((groups[:, :, np.newaxis, :]
+                  - patterns[np.newaxis, np.newaxis]) ** 2).sum(axis=3)
+    return (distances.argmin(axis=2),
+            (distances.min(axis=2) < MAX_DISTANCE).all(axis=1))
+
+
+def _decode_line(dark):
+    """Yield the EANs found in a binarized scanline"""
+    runs, first_dark = _runs(dark)
+    left_patterns, right_patterns = _patterns()
+    for (digits, modules) in LAYOUTS:
+        half = digits // 2
+        length = 3 + 4 * half + 5 + 4 * half + 3
+        if len(runs) <= length:
+            continue
+        windows = _windows(runs, length)
+        starts = np.arange(len(windows))
+        module = windows.sum(axis=1) / modules
+
+        # A barcode starts with a bar after a light quiet zone
+        candidates = (starts % 2 == 0) == first_dark
+        candidates[0] = False
+        candidates[1:] &= runs[:len(windows) - 1] >= QUIET_ZONE * module[1:]
+
+        middle = 3 + 4 * half
+        guards = np.r_[0:3, middle:middle + 5, length - 3:length]
+        normalized = windows[:, guards] / module[:, np.newaxis]
+        candidates &= (np.abs(normalized - 1) < GUARD_TOLERANCE).all(axis=1)
+        candidates = np.flatnonzero(candidates)
+        if not len(candidates):
+            continue
+
+        windows = windows[candidates]
+        left, left_ok = _match(
+            windows[:, 3:middle].reshape(-1, half, 4), left_patterns)
+        right, right_ok = _match(
+            windows[:, middle + 5:length - 3].reshape(-1, half, 4),
+            right_patterns)
+        for index in np.flatnonzero(left_ok & right_ok):
+            number = _number(left[index], right[index], digits)
+            if number is not None and ean_codec.is_valid(number):
+                yield number
+
+
+def _number(left, right, digits):
+    """Build the EAN from the matched patterns of both halves"""
+    parity = ''.join('G' if pattern >= 10 else 'L' for pattern in left)
+    if digits == 8:
+        if 'G' in parity:
+            return None
+        first = ''
+    else:
+        first = FIRST_DIGITS.get(parity)
+        if first is None:
+            return None
+    return first + ''.join(str(pattern % 10) for pattern in left) + ''.join(
+        str(pattern) for pattern in right)
+
+
+def decode(image):
+    """
+    Find the EAN-13 and EAN-8 barcodes in ``image``, a file name, file
+    object or PIL image.
+
+    Returns a list of EANs, the one found on the most scanlines first.
+    """
+    if not isinstance(image, Image.Image):
+        image = Image.open(image)
+        # Let the JPEG decoder scale down, which is much faster
+        image.draft('L', (MAX_SIZE, MAX_SIZE))
+    image = image.convert('L')
+    image.thumbnail((MAX_SIZE, MAX_SIZE))
+    pixels = np.asarray(image, dtype=np.float32)
+    if min(pixels.shape) < 3:
+        return []
+
+    votes = Counter()
+    for orientation in (pixels, pixels.T):
+        dark = _binarize(_scanlines(orientation))
+        # Also read every line backwards, for upside down barcodes
+        for line in itertools.chain(dark, dark[:, ::-1]):
+            votes.update(set(_decode_line(line)))
+    return [number for (number, _) in votes.most_common()]
+
+
+def decode_source(source):
+    """
+    Decode a file name or the contents of a file.
+
+    Returns ``(eans, error)``, with an error message if the file is not an
+    image.
+    """
+    if isinstance(source, bytes):
+        source = io.BytesIO(source)
+    try:
+        return decode(source), None
+    except (OSError, ValueError, Image.DecompressionBombError) as e:
+        return [], str(e) or e.__class__.__name__
+
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def shared_executor(processes=None):
+    """
+    The pool of ``processes`` worker processes for requests, by default one
+    per CPU. It is created on first use and kept for later requests.
+    """
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ProcessPoolExecutor(processes)
+        return _executor
+
+
+def reset_shared_executor(executor):
+    """
+    Forget ``executor`` after a worker crashed and broke it, so the next
+    :func:`shared_executor` creates a new pool.
+    """
+    global _executor
+    with _executor_lock:
+        if _executor is executor:
+            _executor = None
+    executor.shutdown(wait=False)
+
+
+def decode_many(sources, processes=None, executor=None):
+    """
+    Decode file names or file contents in ``executor``, or in a new pool
+    of ``processes`` worker processes, by default one per CPU.
+
+    Yields ``(eans, error)`` for every source, in order.
+    """
+    if executor is not None:
+        yield from executor.map(decode_source, sources)
+        return
+    with ProcessPoolExecutor(processes) as executor:
+        yield from executor.map(decode_source, sources)
@@ -0,0 +1,430 @@
+"""
+Live count changes for open packaging pages, as server-sent events.
+
+:class:`~interface.views.PackagingView` publishes the new count of a product
+to the :data:`hub` of its process after every scan. The hub fans the change
+out to the subscribers of that product in the same process, each with a
+small bounded queue, and to the other processes through ``manage.py
+events_broker`` if ``INTERFACE_EVENTS_BROKER`` is set.
+
+Django 3.0 ties up a thread for every open response, so the event stream is
+served by :class:`EventsApplication`, a plain ASGI application in front of
+Django in :mod:`inventory.asgi`.
+"""
+import asyncio
+import json
+import queue
+import socket
+import threading
+import time
+from collections import defaultdict
+from http.cookies import SimpleCookie
+from importlib import import_module
+from types import SimpleNamespace
+from urllib.parse import parse_qs
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib.auth import get_user
+from django.db import close_old_connections
+from django.urls import reverse
+
+#: Maximal number of products per subscription
+MAX_PRODUCTS = 50
+
+
+def parse_address(address):
+    """Split ``host:port``, the host defaults to localhost"""
+    host, _, port = address.rpartition(':')
+    return host or '127.0.0.1', int(port)
+
+
+def _encode(event):
+    return json.dumps(event).encode() + b'\n'
+
+
+def _decode(line):
+    """Parse an event from the broker, or ``None`` if it isn't one"""
+    try:
+        event = json.loads(line)
+    except ValueError:
+        return None
+    if not isinstance(event, dict) or not isinstance(
+            event.get('product'), int):
+        return None
+    return event
+
+
+class Subscription:
+    """A client of :class:`EventsApplication` listening to ``products``"""
+
+    def __init__(self, products, queue_size):
+        self.products = frozenset(products)
+        self.loop = asyncio.get_event_loop()
+        self.queue = asyncio.Queue(maxsize=queue_size)
+
+    def put(self, event):
+        """
+        Queue ``event`` in the event loop of the client. If the client is
+        slow and its queue is full, the oldest event is dropped: only the
+        latest count of a product matters.
+
+        Returns whether an event was dropped.
+        """
+        dropped = self.queue.full()
+        if dropped:
+            self.queue.get_nowait()
+        self.queue.put_nowait(event)
+        return dropped
+
+
+class Hub:
+    """
+    In-process fan-out of count changes to :class:`Subscription` objects.
+
+    :meth:`publish` may be called from any thread; every subscription only
+    touches its queue in its own event loop.
+    """
+
+    def __init__(self, queue_size=16, broker=None):
+        self.queue_size = queue_size
+        self.broker = broker
+        self.subscribers = 0
+        self.published = 0
+        self.delivered = 0
+        self.dropped = 0
+        self._subscriptions = defaultdict(set)
+        self._client = None
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_settings(cls):
+        return cls(
+            queue_size=getattr(settings, 'INTERFACE_EVENTS_QUEUE_SIZE', 16),
+            broker=getattr(settings, 'INTERFACE_EVENTS_BROKER', None),
+        )
+
+    def _connect(self):
+        """Start the connection to the broker, if there is one"""
+        if self.broker is None:
+            return None
+        with self._lock:
+            if self._client is None:
+                self._client = BrokerClient(self.broker, self)
+            return self._client
+
+    def subscribe(self, products):
+        """Subscribe to changes of ``products``, from a coroutine"""
+        subscription = Subscription(products, self.queue_size)
+        with self._lock:
+            for product in subscription.products:
+                self._subscriptions[product].add(subscription)
+            self.subscribers += 1
+        self._connect()
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            removed = False
+            for product in subscription.products:
+                subscriptions = self._subscriptions.get(product, set())
+                if subscription in subscriptions:
+                    removed = True
+                    subscriptions.discard(subscription)
+                    if not subscriptions:
+                        del self._subscriptions[product]
+            if removed:
+                self.subscribers -= 1
+
+    def publish(self, product, count):
+        """Announce the new ``count`` of ``product`` to all processes"""
+        event = {'product': product, 'count': count, 'at': time.time()}
+        with self._lock:
+            self.published += 1
+        self.deliver(event)
+        client = self._connect()
+        if client is not None:
+            client.send(event)
+
+    def deliver(self, event):
+        """Queue ``event`` for the subscribers in this process"""
+        by_loop = defaultdict(list)
+        with self._lock:
+            for subscription in self._subscriptions.get(event['product'], ()):
+                by_loop[subscription.loop].append(subscription)
+        for (loop, subscriptions) in by_loop.items():
+            try:
+                loop.call_soon_threadsafe(self._put, subscriptions, event)
+            except RuntimeError:
+                # The loop was closed without unsubscribing
+                for subscription in subscriptions:
+                    self.unsubscribe(subscription)
+
+    def _put(self, subscriptions, event):
+        dropped = sum(subscription.put(event)
+                      for subscription in subscriptions)
+        with self._lock:
+            self.delivered += len(subscriptions)
+            self.dropped += dropped
+
+    def stats(self):
+        with self._lock:
+            return {
+                'subscribers': self.subscribers,
+                'published': self.published,
+                'delivered': self.delivered,
+                'dropped': self.dropped,
+            }
+
+
+class BrokerClient:
+    """
+    Connection of a :class:`Hub` to the :class:`Broker`.
+
+    Events published in this process are sent to the broker, and events of
+    other processes are delivered to the local subscribers, from daemon
+    threads. While the broker is unreachable, events are only delivered in
+    this process.
+    """
+
+    #: Seconds to wait before reconnecting
+    reconnect_delay = 1
+
+    #: Number of events to buffer for a slow broker
+    queue_size = 1024
+
+    def __init__(self, address, hub):
+        self.address = parse_address(address)
+        self.hub = hub
+        self.connected = threading.Event()
+        self._outbox = queue.Queue(maxsize=self.queue_size)
+        threading.Thread(target=self._run, daemon=True,
+                         name='interface-events-broker').start()
+
+    def send(self, event):
+        if not self.connected.is_set():
+            return
+        try:
+            self._outbox.put_nowait(event)
+        except queue.Full:
+            with self.hub._lock:
+                self.hub.dropped += 1
+
+    def _run(self):
+        while True:
+            try:
+                connection = socket.create_connection(self.address)
+            except OSError:
+                time.sleep(self.reconnect_delay)
+                continue
+            with connection:
+                connection.setsockopt(
+                    socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+                threading.Thread(target=self._receive, args=(connection,),
+                                 daemon=True).start()
+                self.connected.set()
+                try:
+                    while True:
+                        event = self._outbox.get()
+                        if event is connection:
+                            break
+                        if isinstance(event, dict):
+                            connection.sendall(_encode(event))
+                except OSError:
+                    pass
+                finally:
+                    self.connected.clear()
+                    self._drain()
+                    try:
+                        # Make the receiving thread stop
+                        connection.shutdown(socket.SHUT_RDWR)
+                    except OSError:
+                        pass
+            time.sleep(self.reconnect_delay)
+
+    def _receive(self, connection):
+        try:
+            with connection.makefile('rb') as lines:
+                for line in lines:
+                    event = _decode(line)
+                    if event is not None:
+                        self.hub.deliver(event)
+        except (OSError, ValueError):
+            pass
+        # Wake up the sender of this connection, which reconnects
+        self._outbox.put(connection)
+
+    def _drain(self):
+        """Drop the events of the broken connection, they are outdated"""
+        try:
+            while True:
+                self._outbox.get_nowait()
+        except queue.Empty:
+            pass
+
+
+class Broker:
+    """
+    Stand-in message broker for deployments with several processes: every
+    line a connection sends is forwarded to all other connections.
+    """
+
+    #: Bytes to buffer for a slow connection before dropping its events
+    write_limit = 1 << 20
+
+    def __init__(self):
+        self.forwarded = 0
+        self.dropped = 0
+        self._writers = set()
+        self._handlers = set()
+
+    async def start(self, host, port):
+        """Start serving, returns the :class:`asyncio.AbstractServer`"""
+        return await asyncio.start_server(self._handle, host, port)
+
+    async def close(self):
+        """Disconnect all connections"""
+        for writer in self._writers:
+            writer.close()
+        await asyncio.gather(*self._handlers)
+
+    async def _handle(self, reader, writer):
+        handler = asyncio.current_task()
+        self._handlers.add(handler)
+        self._writers.add(writer)
+        try:
+            while True:
+                line = await reader.readline()
+                if not line.endswith(b'\n'):
+                    break
+                for other in self._writers:
+                    if other is writer:
+                        continue
+                    if (other.transport.get_write_buffer_size()
+                            > self.write_limit):
+                        self.dropped += 1
+                        continue
+                    other.write(line)
+                    self.forwarded += 1
+        except (ConnectionError, ValueError):
+            pass
+        finally:
+            self._writers.discard(writer)
+            self._handlers.discard(handler)
+            writer.close()
+
+
+hub = Hub.from_settings()
+
+
+def _authenticated(session_key):
+    """
+    Whether ``session_key`` belongs to a logged in user, checked like
+    Django's authentication middleware: the user must exist, be active and
+    have the password they logged in with.
+    """
+    engine = import_module(settings.SESSION_ENGINE)
+    request = SimpleNamespace(session=engine.SessionStore(session_key))
+    try:
+        return get_user(request).is_authenticated
+    finally:
+        close_old_connections()
+
+
+async def _respond(send, status, body):
+    await send({
+        'type': 'http.response.start',
+        'status': status,
+        'headers': [(b'content-type', b'text/plain; charset=utf-8')],
+    })
+    await send({'type': 'http.response.body', 'body': body})
+
+
+async def _disconnected(receive):
+    while (await receive())['type'] != 'http.disconnect':
+        pass
+
+
+class EventsApplication:
+    """
+    ASGI application streaming count changes to logged in users at
+    ``interface:events``, and passing everything else to ``application``.
+
+    Clients pass the products to listen to as ``?product=<pk>``, up to
+    :data:`MAX_PRODUCTS` times. Every change is a ``count`` event with a
+    JSON object of the ``product``, its ``count`` and when it changed
+    (``at``, in seconds since the epoch).
+    """
+
+    def __init__(self, application, hub=hub):
+        self.application = application
+        self.hub = hub
+        self.keepalive = getattr(settings, 'INTERFACE_EVENTS_KEEPALIVE', 15)
+        self._path = None
+
+    @property
+    def path(self):
+        if self._path is None:
+            self._path = reverse('interface:events')
+        return self._path
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http' or scope['path'] != self.path:
+            return await self.application(scope, receive, send)
+
+        cookies = SimpleCookie()
+        for (name, value) in scope['headers']:
+            if name == b'cookie':
+                cookies.load(value.decode('latin1'))
+        session = cookies.get(settings.SESSION_COOKIE_NAME)
+        if session is None or not await sync_to_async(_authenticated)(
+                session.value):
+            return await _respond(send, 403, b"Log in to receive events")
+
+        try:
+            products = {int(product) for product in parse_qs(
+                scope['query_string'].decode('latin1')).get('product', ())}
+        except ValueError:
+            return await _respond(send, 400, b"Products should be numbers")
+        if not products or len(products) > MAX_PRODUCTS:
+            return await _respond(
+                send, 400,
+                f"Pass 1 to {MAX_PRODUCTS} products".encode())
+
+        await self.stream(products, receive, send)
+
+    async def stream(self, products, receive, send):
+        subscription = self.hub.subscribe(products)
+        disconnected = asyncio.ensure_future(_disconnected(receive))
+        event = asyncio.ensure_future(subscription.queue.get())
+        try:
+            await send({
+                'type': 'http.response.start',
+                'status': 200,
+                'headers': [
+                    (b'content-type', b'text/event-stream'),
+                    (b'cache-control', b'no-cache'),
+                    # Don't let proxies buffer the stream
+                    (b'x-accel-buffering', b'no'),
+                ],
+            })
+            await send({'type': 'http.response.body',
+                        'body': b'retry: 5000\n\n', 'more_body': True})
+            while True:
+                done, _ = await asyncio.wait(
+                    {event, disconnected}, timeout=self.keepalive,
+                    return_when=asyncio.FIRST_COMPLETED)
+                if disconnected in done:
+                    break
+                if event in done:
+                    body = (b'event: count\ndata: '
+                            + json.dumps(event.result()).encode() + b'\n\n')
+                    event = asyncio.ensure_future(subscription.queue.get())
+                else:
+                    body = b': keepalive\n\n'
+                await send({'type': 'http.response.body', 'body': body,
+                            'more_body': True})
+        finally:
+            self.hub.unsubscribe(subscription)
+            event.cancel()
+            disconnected.cancel()
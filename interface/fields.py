@@ -2,6 +2,7 @@ import stdnum.ean
 from django import forms
 from django.db.models import fields
 
+from interface import ean
 from interface.validators import ean_validator
 
 
@@ -12,8 +13,10 @@ class EANFormField(forms.Field):
             kwargs.get('validators', []) + [ean_validator])
         super().__init__(*args, **kwargs)
 
-    def clean(self, value):
-        return super().clean(value)
+    def to_python(self, value):
+        if value in self.empty_values:
+            return ''
+        return ean.compact(str(value))
 
 
 class EANField(fields.CharField):
@@ -35,7 +38,9 @@ class EANField(fields.CharField):
         return super().formfield(**kwargs)
 
     def to_python(self, value):
-        return stdnum.ean.compact(value)
+        if value is None:
+            return value
+        return ean.compact(value)
 
     def __str__(self):
         return stdnum.ean.format(self.value)
@@ -9,6 +9,11 @@ class ProductScannerForm(forms.Form):
     ean = EANFormField()
 
 
+class StocktakeScanForm(forms.Form):
+    ean = EANFormField()
+    quantity = forms.IntegerField(min_value=1, initial=1)
+
+
 class PackagingForm(forms.ModelForm):
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
@@ -22,7 +27,7 @@ class ProductForm(forms.ModelForm):
 
     class Meta:
         model = models.Product
-        exclude = ['count']
+        exclude = ['count', 'count_shards']
         widgets = {
             'brand': autocomplete.ModelSelect2(
                 url='interface:brand-autocomplete',
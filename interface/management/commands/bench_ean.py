@@ -0,0 +1,46 @@
+import random
+import timeit
+
+import stdnum.ean
+from django.core.management.base import BaseCommand
+
+from interface import ean
+
+
+class Command(BaseCommand):
+    help = "Compare the speed of interface.ean with stdnum.ean"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--count', type=int, default=10000,
+                            help="Number of EANs to validate per round")
+        parser.add_argument('--rounds', type=int, default=5)
+
+    def handle(self, *args, count, rounds, **options):
+        rng = random.Random(0)
+        numbers = []
+        for _ in range(count):
+            digits = ''.join(rng.choice('0123456789') for _ in range(12))
+            numbers.append(digits + stdnum.ean.calc_check_digit(digits))
+
+        def run_stdnum():
+            for number in numbers:
+                stdnum.ean.validate(number)
+
+        def run_ean():
+            for number in numbers:
+                ean.validate(number)
+
+        def run_ean_many():
+            ean.validate_many(numbers)
+
+        baseline = None
+        for name, func in [('stdnum.ean.validate', run_stdnum),
+                           ('interface.ean.validate', run_ean),
+                           ('interface.ean.validate_many', run_ean_many)]:
+            best = min(timeit.repeat(func, number=1, repeat=rounds))
+            per_call = best / count * 1e9
+            if baseline is None:
+                baseline = best
+            self.stdout.write(
+                f"{name:30} {per_call:8.0f} ns/EAN "
+                f"({baseline / best:.1f}x)")
@@ -0,0 +1,205 @@
+import itertools
+import json
+import time
+
+import stdnum.ean
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.test import Client, RequestFactory, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from interface import search, views
+from interface.models import (Brand, BrandPrefix, GenericProduct, Packaging,
+                              Product)
+
+#: Maximum number of queries and 95th percentile latency in milliseconds.
+#: The client requests include two queries for the session and the user,
+#: the autocomplete views count the results and check the permission to
+#: create new objects. The packaging page and the autocomplete views read
+#: their ETag first, one query which lets unchanged responses answer 304
+#: without any of the others. Scans look up the EAN in the database rather
+#: than the cache and also update the stock of the generic product.
+BUDGETS = {
+    'scanner_post': (2, 50),
+    'packaging_get': (5, 100),
+    'packaging_post': (7, 50),
+    'select_product_get': (5, 200),
+    'brand_by_ean': (1, 10),
+    'product_clean': (1, 20),
+    'brand_autocomplete': (7, 100),
+    'product_autocomplete': (5, 100),
+    'generic_product_autocomplete': (4, 100),
+}
+
+#: Packagings per brand and per product in the synthetic catalog
+PACKAGINGS_PER_BRAND = 100
+PACKAGINGS_PER_PRODUCT = 2
+PRODUCTS_PER_GENERIC_PRODUCT = 20
+
+
+def make_ean(brand, item):
+    digits = f"8{brand:06d}{item:05d}"
+    return digits + stdnum.ean.calc_check_digit(digits)
+
+
+def bulk_create(model, objects, chunk_size=10000):
+    """Insert ``objects`` without keeping them all in memory"""
+    objects = iter(objects)
+    while True:
+        chunk = list(itertools.islice(objects, chunk_size))
+        if not chunk:
+            return
+        model.objects.bulk_create(chunk)
+
+
+def percentile(values, fraction):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(fraction * len(values)))]
+
+
+def populate(packagings):
+    """Create a synthetic catalog of ``packagings`` packagings"""
+    brands = max(1, packagings // PACKAGINGS_PER_BRAND)
+    bulk_create(Brand, (Brand(name=f"Brand {i}") for i in range(brands)))
+    brand_pks = list(Brand.objects.order_by('pk')
+                     .values_list('pk', flat=True))
+
+    products = max(1, packagings // PACKAGINGS_PER_PRODUCT)
+    generic_products = max(1, products // PRODUCTS_PER_GENERIC_PRODUCT)
+    bulk_create(GenericProduct, (GenericProduct(name=f"Generic {i}")
+                                 for i in range(generic_products)))
+    generic_pks = list(GenericProduct.objects.order_by('pk')
+                       .values_list('pk', flat=True))
+
+    products_per_brand = PACKAGINGS_PER_BRAND // PACKAGINGS_PER_PRODUCT
+    bulk_create(Product, (
+        Product(brand_id=brand_pks[(i // products_per_brand) % brands],
+                name=f"Product {i}",
+                generic_product_id=generic_pks[i % generic_products],
+                count=10)
+        for i in range(products)))
+    product_pks = list(Product.objects.order_by('pk')
+                       .values_list('pk', flat=True))
+
+    bulk_create(Packaging, (
+        Packaging(label=make_ean(i // PACKAGINGS_PER_BRAND,
+                                 i % PACKAGINGS_PER_BRAND),
+                  product_id=product_pks[
+                      (i // PACKAGINGS_PER_PRODUCT) % products],
+                  count=1 + i % PACKAGINGS_PER_PRODUCT)
+        for i in range(packagings)))
+
+    BrandPrefix.rebuild()
+    search.rebuild()
+
+
+def make_cases(user):
+    """The requests to measure, as functions of the iteration"""
+    client = Client()
+    client.force_login(user)
+
+    def generic_request():
+        request = RequestFactory().get('/', {'q': 'Gene'})
+        request.user = user
+        return request
+
+    ean = make_ean(0, 0)
+    unknown_ean = make_ean(0, PACKAGINGS_PER_BRAND)
+    product = Product.objects.get(packaging__label=ean)
+    packaging_url = reverse('interface:packaging', kwargs={'ean': ean})
+    actions = ['add', 'subtract']
+
+    return {
+        'scanner_post': lambda i: client.post(
+            reverse('interface:index'), {'ean': ean}),
+        'packaging_get': lambda i: client.get(packaging_url),
+        'packaging_post': lambda i: client.post(
+            packaging_url, {'action': actions[i % 2]}),
+        'select_product_get': lambda i: client.get(reverse(
+            'interface:select_product_for_packaging',
+            kwargs={'ean': unknown_ean})),
+        'brand_by_ean': lambda i: Brand.by_ean(unknown_ean),
+        'product_clean': lambda i: product.clean(),
+        'brand_autocomplete': lambda i: client.get(
+            reverse('interface:brand-autocomplete'), {'q': 'Bran'}),
+        'product_autocomplete': lambda i: client.get(
+            reverse('interface:product-autocomplete'), {'q': 'Prod'}),
+        'generic_product_autocomplete': lambda i: (
+            views.GenericProductAutocompleteView.as_view()(
+                generic_request())),
+    }
+
+
+class Command(BaseCommand):
+    help = ("Measure query counts and latencies of the scan flow against a "
+            "synthetic catalog in a temporary database")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--packagings', type=int, default=1000,
+                            help="Size of the synthetic catalog")
+        parser.add_argument('--iterations', type=int, default=50)
+        parser.add_argument('--output', help="Write the results as JSON")
+        parser.add_argument('--no-latency-budget', action='store_true',
+                            help="Only check the query budgets")
+
+    def handle(self, *args, packagings, iterations, output,
+               no_latency_budget, **options):
+        old_name = connection.settings_dict['NAME']
+        connection.creation.create_test_db(verbosity=0, autoclobber=True)
+        try:
+            with transaction.atomic():
+                populate(packagings)
+            with override_settings(ALLOWED_HOSTS=['testserver']):
+                results = self.run_cases(iterations)
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+
+        report = {
+            'packagings': packagings,
+            'iterations': iterations,
+            'vendor': connection.vendor,
+            'results': results,
+        }
+        text = json.dumps(report, indent=2)
+        if output:
+            with open(output, 'w') as f:
+                f.write(text)
+        else:
+            self.stdout.write(text)
+
+        failures = []
+        for name, result in results.items():
+            max_queries, max_p95 = BUDGETS[name]
+            if result['queries'] > max_queries:
+                failures.append(f"{name}: {result['queries']} queries, "
+                                f"budget is {max_queries}")
+            if not no_latency_budget and result['p95_ms'] > max_p95:
+                failures.append(f"{name}: p95 {result['p95_ms']:.1f}ms, "
+                                f"budget is {max_p95}ms")
+        if failures:
+            raise CommandError("Budget exceeded:\n" + "\n".join(failures))
+
+    def run_cases(self, iterations):
+        user = get_user_model().objects.create_user('benchmark')
+        cases = make_cases(user)
+
+        results = {}
+        for name, case in cases.items():
+            case(0)  # warm up caches
+            timings = []
+            queries = 0
+            for i in range(iterations):
+                with CaptureQueriesContext(connection) as captured:
+                    start = time.perf_counter()
+                    case(i)
+                    timings.append(time.perf_counter() - start)
+                queries = max(queries, len(captured.captured_queries))
+            results[name] = {
+                'queries': queries,
+                'p50_ms': round(percentile(timings, .50) * 1000, 3),
+                'p95_ms': round(percentile(timings, .95) * 1000, 3),
+                'p99_ms': round(percentile(timings, .99) * 1000, 3),
+            }
+        return results
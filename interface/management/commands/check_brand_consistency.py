@@ -0,0 +1,36 @@
+from collections import defaultdict
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models.functions import Substr
+
+from interface.models import Brand, Packaging, Product
+
+
+class Command(BaseCommand):
+    help = ("Check that the brand identifiers of all EANs belong to a single "
+            "brand")
+
+    def handle(self, *args, **options):
+        conflicts = Product.brand_conflicts(Product.objects.all())
+        if not conflicts:
+            self.stdout.write(self.style.SUCCESS("All brands are consistent"))
+            return
+
+        prefixes = set().union(*conflicts.values())
+        brands = defaultdict(set)
+        for (prefix, brand) in (
+                Packaging.objects
+                .annotate(prefix=Substr(
+                    'label', 1, Brand.BRAND_IDENTIFIER_LENGTH))
+                .filter(prefix__in=prefixes)
+                .values_list('prefix', 'product__brand__name')
+                .distinct()):
+            brands[prefix].add(brand)
+
+        products = Product.objects.select_related('brand').in_bulk(conflicts)
+        for pk, product_prefixes in sorted(conflicts.items()):
+            for prefix in sorted(product_prefixes):
+                self.stdout.write(
+                    f"{products[pk]}: {prefix} is shared by "
+                    f"{', '.join(sorted(brands[prefix]))}")
+        raise CommandError(f"{len(conflicts)} products have conflicts")
@@ -0,0 +1,87 @@
+from html.parser import HTMLParser
+from urllib.parse import urlsplit
+
+from django.conf import settings
+from django.contrib.auth.models import AnonymousUser
+from django.contrib.staticfiles import finders
+from django.contrib.staticfiles.storage import staticfiles_storage
+from django.core.management.base import BaseCommand, CommandError
+from django.template.loader import render_to_string
+from django.test import RequestFactory
+
+from interface import forms
+from interface.models import Stocktake
+
+
+class AssetParser(HTMLParser):
+    """Collect the URLs of everything a page makes the browser load"""
+
+    #: Attribute of each tag that makes the browser load something
+    attributes = {
+        'script': 'src',
+        'link': 'href',
+        'img': 'src',
+        'source': 'src',
+        'iframe': 'src',
+    }
+
+    def __init__(self):
+        super().__init__()
+        self.urls = []
+
+    def handle_starttag(self, tag, attrs):
+        url = dict(attrs).get(self.attributes.get(tag))
+        if url:
+            self.urls.append(url)
+
+
+class Command(BaseCommand):
+    help = ("Check that the scanner pages only load static files that we "
+            "serve ourselves")
+
+    def pages(self):
+        """The templates that have to work on a bad connection"""
+        yield 'interface/index.html', {'form': forms.ProductScannerForm()}
+        yield 'interface/stocktake.html', {
+            'form': forms.StocktakeScanForm(),
+            'stocktake': Stocktake(pk=0),
+        }
+
+    def handle(self, *args, **options):
+        request = RequestFactory().get('/')
+        request.user = AnonymousUser()
+
+        problems = []
+        for (template, context) in self.pages():
+            try:
+                html = render_to_string(template, context, request=request)
+            except ValueError as e:
+                # The manifest storage doesn't know the file
+                raise CommandError(f"{template}: {e}") from e
+            parser = AssetParser()
+            parser.feed(html)
+            for url in parser.urls:
+                problem = self.check_url(url)
+                if problem is not None:
+                    problems.append(f"{template}: {url} {problem}")
+
+        for problem in problems:
+            self.stdout.write(problem)
+        if problems:
+            raise CommandError(f"{len(problems)} problems with static files")
+        self.stdout.write(self.style.SUCCESS(
+            "The scanner pages only load our own static files"))
+
+    def check_url(self, url):
+        parts = urlsplit(url)
+        if parts.scheme == 'data':
+            return None
+        if parts.scheme or parts.netloc:
+            return "is loaded from another origin"
+        if not parts.path.startswith(settings.STATIC_URL):
+            return None
+
+        name = parts.path[len(settings.STATIC_URL):]
+        if finders.find(name) is None and not staticfiles_storage.exists(name):
+            return "does not exist, run ./update-js.sh"
+        return None
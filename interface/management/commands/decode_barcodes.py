@@ -0,0 +1,47 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from interface import decode
+from interface.cache import ean_cache
+from interface.models import Packaging
+
+
+class Command(BaseCommand):
+    help = ("Decode the EAN barcodes in images, and look up their products. "
+            "Reports the throughput in images per second.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('images', nargs='+', metavar='image')
+        parser.add_argument(
+            '--processes', type=int, default=None,
+            help="Number of worker processes, by default one per CPU")
+
+    def handle(self, *args, images, processes, **options):
+        if not decode.AVAILABLE:
+            raise CommandError(
+                "Decoding barcodes needs NumPy and Pillow, install them with "
+                "`pip install numpy Pillow`")
+
+        found = 0
+        start = time.perf_counter()
+        for (image, (eans, error)) in zip(
+                images, decode.decode_many(images, processes)):
+            if error is not None:
+                self.stderr.write(f"{image}: {error}")
+                continue
+            if not eans:
+                self.stdout.write(f"{image}: no barcode found")
+                continue
+            found += 1
+            for ean in eans:
+                try:
+                    product = f"product {ean_cache.resolve(ean).product}"
+                except Packaging.DoesNotExist:
+                    product = "unknown"
+                self.stdout.write(f"{image}: {ean} ({product})")
+        elapsed = time.perf_counter() - start
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Found barcodes in {found} of {len(images)} images in "
+            f"{elapsed:.2f}s ({len(images) / elapsed:.1f} images/s)"))
@@ -0,0 +1,31 @@
+import asyncio
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from interface.events import Broker, parse_address
+
+
+class Command(BaseCommand):
+    help = ("Pass live count changes between the processes serving the "
+            "scanner pages. Point INVENTORY_EVENTS_BROKER of every process "
+            "at this address.")
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--bind',
+            default=(getattr(settings, 'INTERFACE_EVENTS_BROKER', None)
+                     or '127.0.0.1:8765'),
+            help="host:port to listen on")
+
+    def handle(self, *args, bind, **options):
+        try:
+            asyncio.run(self.serve(*parse_address(bind)))
+        except KeyboardInterrupt:
+            pass
+
+    async def serve(self, host, port):
+        server = await Broker().start(host, port)
+        self.stdout.write(f"Listening on {host}:{port}")
+        async with server:
+            await server.serve_forever()
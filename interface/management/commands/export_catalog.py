@@ -0,0 +1,25 @@
+import sys
+
+from django.core.management.base import BaseCommand
+
+from interface import catalog
+
+
+class Command(BaseCommand):
+    help = ("Export all products with their brand, generic product, count and "
+            "EANs as CSV or JSONL")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--format', choices=sorted(catalog.EXPORT_FORMATS),
+                            default='csv')
+        parser.add_argument('--output', help="Output file, default stdout")
+
+    def handle(self, *args, format, output, **options):
+        writer, _ = catalog.EXPORT_FORMATS[format]
+        f = open(output, 'w', newline='') if output else sys.stdout
+        try:
+            for chunk in writer(catalog.export_rows()):
+                f.write(chunk)
+        finally:
+            if output:
+                f.close()
@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from interface.models import Product
+
+
+class Command(BaseCommand):
+    help = ("Add the count shards of busy products to their counts and the "
+            "generic product stock. Run this periodically, e.g. every minute "
+            "from cron.")
+
+    def handle(self, *args, **options):
+        folded = Product.fold_counts()
+        self.stdout.write(self.style.SUCCESS(
+            f"Folded the shards of {folded} products"))
@@ -0,0 +1,61 @@
+import contextlib
+import csv
+import sys
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from interface import catalog
+
+
+class Command(BaseCommand):
+    help = ("Import a catalog of EANs with their brand, product, generic "
+            "product and pack count from CSV or JSONL")
+
+    def add_arguments(self, parser):
+        parser.add_argument('file', help="Catalog file, or - for stdin")
+        parser.add_argument('--format', choices=['csv', 'jsonl'],
+                            help="File format, by default from the extension")
+        parser.add_argument('--chunk-size', type=int, default=500,
+                            help="Rows per transaction")
+        parser.add_argument('--rejects',
+                            help="Write rejected rows with reasons to this "
+                                 "CSV file")
+
+    def handle(self, *args, file, format, chunk_size, rejects, **options):
+        if format is None:
+            if file.endswith('.jsonl'):
+                format = 'jsonl'
+            elif file.endswith('.csv'):
+                format = 'csv'
+            else:
+                raise CommandError("Can't guess the format, use --format")
+        reader = catalog.read_jsonl if format == 'jsonl' else catalog.read_csv
+
+        importer = catalog.CatalogImporter(chunk_size=chunk_size)
+        rejected = 0
+        start = time.perf_counter()
+        with contextlib.ExitStack() as stack:
+            f = sys.stdin
+            if file != '-':
+                f = stack.enter_context(open(file, newline=''))
+            writer = None
+            if rejects:
+                writer = csv.writer(
+                    stack.enter_context(open(rejects, 'w', newline='')))
+                writer.writerow(('row', 'reason') + catalog.COLUMNS)
+
+            for rejection in importer.run(reader(f)):
+                rejected += 1
+                if writer is None:
+                    self.stderr.write(str(rejection))
+                    continue
+                writer.writerow(
+                    (rejection.number, rejection.reason)
+                    + tuple(rejection.row.get(column)
+                            for column in catalog.COLUMNS))
+
+        elapsed = time.perf_counter() - start
+        self.stdout.write(self.style.SUCCESS(
+            f"Imported {importer.imported} packagings in {elapsed:.1f}s, "
+            f"rejected {rejected} rows"))
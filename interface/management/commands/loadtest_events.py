@@ -0,0 +1,144 @@
+import asyncio
+import json
+import threading
+import time
+import tracemalloc
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.test import Client
+from django.urls import reverse
+
+from interface.events import Broker, EventsApplication, Hub
+from interface.management.commands.loadtest_scan import percentile
+
+
+async def _not_found(scope, receive, send):
+    raise AssertionError(f"Unexpected request for {scope['path']}")
+
+
+class Command(BaseCommand):
+    help = ("Open many idle live count streams in this process, publish "
+            "count changes and report the fan-out latency and memory use")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--subscribers', type=int, default=500)
+        parser.add_argument('--events', type=int, default=50,
+                            help="Number of count changes to publish")
+        parser.add_argument('--products', type=int, default=10,
+                            help="Number of products the changes are spread "
+                                 "over; every subscriber listens to one")
+        parser.add_argument('--broker', action='store_true',
+                            help="Publish from another hub through a broker, "
+                                 "like another process would")
+
+    def handle(self, *args, subscribers, events, products, broker,
+               **options):
+        user = get_user_model().objects.create_user('loadtest-events')
+        try:
+            client = Client()
+            client.force_login(user)
+            session = client.cookies[settings.SESSION_COOKIE_NAME].value
+            results = asyncio.run(self.run(
+                session, subscribers, events, products, broker))
+        finally:
+            user.delete()
+
+        (latencies, received, expected, memory, stats, elapsed) = results
+        self.stdout.write(
+            f"{subscribers} subscribers, {events} events in {elapsed:.2f}s\n"
+            f"received {received} of {expected} events, "
+            f"dropped {stats['dropped']}\n"
+            f"fan-out latency p50 {percentile(latencies, .50) * 1000:.1f}ms, "
+            f"p99 {percentile(latencies, .99) * 1000:.1f}ms, "
+            f"max {max(latencies) * 1000:.1f}ms\n"
+            f"{memory / subscribers / 1024:.1f} KiB per idle subscriber")
+        if received < expected:
+            raise CommandError(f"Lost {expected - received} events")
+        self.stdout.write(self.style.SUCCESS("All events delivered"))
+
+    async def run(self, session, subscribers, events, products, broker):
+        hub = publisher = Hub()
+        if broker:
+            event_broker = Broker()
+            server = await event_broker.start('127.0.0.1', 0)
+            address = '127.0.0.1:%d' % server.sockets[0].getsockname()[1]
+            hub = Hub(broker=address)
+            publisher = Hub(broker=address)
+        application = EventsApplication(_not_found, hub=hub)
+        path = reverse('interface:events')
+        cookie = f'{settings.SESSION_COOKIE_NAME}={session}'.encode()
+
+        done = asyncio.Event()
+        latencies = []
+        received = [0]
+
+        async def subscriber(product):
+            async def receive():
+                await done.wait()
+                return {'type': 'http.disconnect'}
+
+            async def send(message):
+                body = message.get('body', b'')
+                if not body.startswith(b'event: count'):
+                    if message['type'] == 'http.response.start' and (
+                            message['status'] != 200):
+                        raise CommandError(
+                            f"Subscribing failed: {message['status']}")
+                    return
+                event = json.loads(body.split(b'data: ', 1)[1])
+                latencies.append(time.time() - event['at'])
+                received[0] += 1
+
+            await application({
+                'type': 'http',
+                'path': path,
+                'query_string': f'product={product}'.encode(),
+                'headers': [(b'cookie', cookie)],
+            }, receive, send)
+
+        tracemalloc.start()
+        before = tracemalloc.get_traced_memory()[0]
+        tasks = [asyncio.ensure_future(subscriber(index % products))
+                 for index in range(subscribers)]
+        while hub.stats()['subscribers'] < subscribers:
+            await asyncio.sleep(.01)
+            for task in tasks:
+                if task.done():
+                    task.result()
+        memory = tracemalloc.get_traced_memory()[0] - before
+        tracemalloc.stop()
+
+        if broker:
+            # Both hubs subscribe to the broker before publishing
+            publisher._connect()
+            while not (hub._client.connected.is_set()
+                       and publisher._client.connected.is_set()):
+                await asyncio.sleep(.01)
+
+        # Publish from another thread, like a view would
+        def publish():
+            for index in range(events):
+                publisher.publish(index % products, index)
+                time.sleep(.001)
+
+        start = time.perf_counter()
+        thread = threading.Thread(target=publish)
+        thread.start()
+        expected = sum(subscribers // products
+                       + (index % products < subscribers % products)
+                       for index in range(events))
+        deadline = time.perf_counter() + 10
+        while received[0] < expected and time.perf_counter() < deadline:
+            await asyncio.sleep(.01)
+        elapsed = time.perf_counter() - start
+        thread.join()
+
+        done.set()
+        await asyncio.gather(*tasks)
+        if broker:
+            server.close()
+            await event_broker.close()
+        return (latencies, received[0], expected, memory, hub.stats(),
+                elapsed)
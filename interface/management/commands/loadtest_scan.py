@@ -0,0 +1,92 @@
+import threading
+import time
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test import Client, override_settings
+from django.urls import reverse
+
+from interface.models import Brand, Packaging, Product
+
+#: EAN of the packaging created for the load test
+EAN = '0000000000000'
+
+
+def percentile(values, fraction):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(fraction * len(values)))]
+
+
+class Command(BaseCommand):
+    help = ("Run the scan flow from several threads against the configured "
+            "database and report throughput and lost updates")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--threads', type=int, default=8)
+        parser.add_argument('--scans', type=int, default=50,
+                            help="Number of scans per thread")
+        parser.add_argument('--shards', type=int, default=0,
+                            help="Spread the count over this many rows")
+
+    def handle(self, *args, threads, scans, shards, **options):
+        if Packaging.objects.filter(label=EAN).exists():
+            raise CommandError(f"Packaging {EAN} already exists")
+
+        user = get_user_model().objects.create_user('loadtest-scan')
+        brand = Brand.objects.create(name='Load test brand')
+        product = Product.objects.create(brand=brand, name='Load test',
+                                         count_shards=shards)
+        Packaging.objects.create(label=EAN, product=product)
+
+        latencies = []
+        errors = []
+
+        def station():
+            client = Client()
+            client.force_login(user)
+            packaging_url = reverse('interface:packaging', kwargs={'ean': EAN})
+            try:
+                for i in range(scans):
+                    start = time.perf_counter()
+                    try:
+                        client.post(reverse('interface:index'), {'ean': EAN})
+                        client.get(packaging_url)
+                        client.post(packaging_url, {'action': 'add'})
+                        client.post(packaging_url, {'action': 'subtract'})
+                    except Exception as e:  # noqa: B902
+                        errors.append(e)
+                    latencies.append(time.perf_counter() - start)
+            finally:
+                connection.close()
+
+        try:
+            with override_settings(ALLOWED_HOSTS=['testserver']):
+                workers = [threading.Thread(target=station)
+                           for _ in range(threads)]
+                start = time.perf_counter()
+                for worker in workers:
+                    worker.start()
+                for worker in workers:
+                    worker.join()
+                elapsed = time.perf_counter() - start
+
+            count = Product.live_count(product.pk)
+        finally:
+            product.delete()
+            brand.delete()
+            user.delete()
+
+        self.stdout.write(
+            f"{connection.vendor}: {len(latencies)} scans in {elapsed:.2f}s "
+            f"({len(latencies) / elapsed:.1f} scans/s)\n"
+            f"latency p50 {percentile(latencies, .50) * 1000:.1f}ms, "
+            f"p95 {percentile(latencies, .95) * 1000:.1f}ms, "
+            f"p99 {percentile(latencies, .99) * 1000:.1f}ms")
+        for error in set(map(repr, errors)):
+            self.stderr.write(error)
+        if errors:
+            raise CommandError(f"{len(errors)} scans failed")
+        if count != 0:
+            raise CommandError(f"Lost updates: final count is {count}")
+        self.stdout.write(self.style.SUCCESS("No lost updates"))
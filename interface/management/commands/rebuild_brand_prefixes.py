@@ -0,0 +1,12 @@
+from django.core.management.base import BaseCommand
+
+from interface.models import BrandPrefix
+
+
+class Command(BaseCommand):
+    help = "Rebuild the brand prefix index from the existing packagings"
+
+    def handle(self, *args, **options):
+        BrandPrefix.rebuild()
+        self.stdout.write(self.style.SUCCESS(
+            f"Indexed {BrandPrefix.objects.count()} brand prefixes"))
@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from interface import search
+
+
+class Command(BaseCommand):
+    help = "Rebuild the autocomplete search index"
+
+    def handle(self, *args, **options):
+        search.rebuild()
+        self.stdout.write(self.style.SUCCESS("Rebuilt the search index"))
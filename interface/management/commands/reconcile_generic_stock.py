@@ -0,0 +1,16 @@
+from django.core.management.base import BaseCommand
+
+from interface.models import GenericProduct
+
+
+class Command(BaseCommand):
+    help = "Recompute the stock of all generic products from the products"
+
+    def handle(self, *args, **options):
+        drifted = GenericProduct.reconcile()
+        if drifted:
+            self.stdout.write(self.style.WARNING(
+                f"Corrected the stock of {drifted} generic products"))
+        else:
+            self.stdout.write(self.style.SUCCESS(
+                "The stock of all generic products was correct"))
@@ -0,0 +1,12 @@
+from django.core.management.base import BaseCommand
+
+from interface.models import StockSnapshot
+
+
+class Command(BaseCommand):
+    help = ("Snapshot the stock of all products that changed since their last "
+            "snapshot. Run this periodically, e.g. daily from cron.")
+
+    def handle(self, *args, **options):
+        taken = StockSnapshot.take()
+        self.stdout.write(self.style.SUCCESS(f"Took {taken} snapshots"))
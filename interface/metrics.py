@@ -0,0 +1,193 @@
+"""
+In-process request metrics, exported in the Prometheus text format.
+
+Enable them with ``INVENTORY_METRICS=1``, which adds
+:class:`MetricsMiddleware` and the :class:`TimedDjangoTemplates` backend in
+the settings. The metrics are served by
+:class:`~interface.views.MetricsView`.
+"""
+import bisect
+import contextvars
+import threading
+import time
+
+from django.db import connections
+from django.template.backends.django import DjangoTemplates
+
+from interface import events
+from interface.cache import autocomplete_cache, ean_cache
+
+#: Upper bounds of the latency histogram buckets, in seconds
+BUCKETS = (.005, .01, .025, .05, .1, .25, .5, 1, 2.5, 5, 10)
+
+#: Measurements of the current request: queries, SQL time, template time
+_current = contextvars.ContextVar('interface_metrics', default=None)
+
+
+class ViewStats:
+    __slots__ = ('buckets', 'count', 'seconds', 'queries', 'sql_seconds',
+                 'template_seconds')
+
+    def __init__(self):
+        self.buckets = [0] * (len(BUCKETS) + 1)
+        self.count = 0
+        self.seconds = 0.0
+        self.queries = 0
+        self.sql_seconds = 0.0
+        self.template_seconds = 0.0
+
+
+class Aggregator:
+    """Thread-safe totals per view name"""
+
+    def __init__(self):
+        self._stats = {}
+        self._lock = threading.Lock()
+
+    def record(self, view, seconds, queries, sql_seconds, template_seconds):
+        bucket = bisect.bisect_left(BUCKETS, seconds)
+        with self._lock:
+            stats = self._stats.get(view)
+            if stats is None:
+                stats = self._stats[view] = ViewStats()
+            stats.buckets[bucket] += 1
+            stats.count += 1
+            stats.seconds += seconds
+            stats.queries += queries
+            stats.sql_seconds += sql_seconds
+            stats.template_seconds += template_seconds
+
+    def clear(self):
+        with self._lock:
+            self._stats.clear()
+
+    def render(self):
+        """Render all metrics in the Prometheus text format"""
+        with self._lock:
+            stats = sorted(self._stats.items())
+            lines = [
+                "# HELP inventory_request_duration_seconds "
+                "Request latency per view.",
+                "# TYPE inventory_request_duration_seconds histogram",
+            ]
+            for view, view_stats in stats:
+                cumulative = 0
+                for bound, count in zip(BUCKETS + ('+Inf',),
+                                        view_stats.buckets):
+                    cumulative += count
+                    lines.append(
+                        f'inventory_request_duration_seconds_bucket'
+                        f'{{view="{view}",le="{bound}"}} {cumulative}')
+                lines.append(f'inventory_request_duration_seconds_sum'
+                             f'{{view="{view}"}} {view_stats.seconds}')
+                lines.append(f'inventory_request_duration_seconds_count'
+                             f'{{view="{view}"}} {view_stats.count}')
+            for name, attribute, help_text in [
+                    ('inventory_request_queries_total', 'queries',
+                     "SQL queries per view."),
+                    ('inventory_request_sql_seconds_total', 'sql_seconds',
+                     "Time spent in SQL queries per view."),
+                    ('inventory_request_template_seconds_total',
+                     'template_seconds',
+                     "Time spent rendering templates per view.")]:
+                lines.append(f"# HELP {name} {help_text}")
+                lines.append(f"# TYPE {name} counter")
+                for view, view_stats in stats:
+                    lines.append(f'{name}{{view="{view}"}} '
+                                 f'{getattr(view_stats, attribute)}')
+
+        cache_stats = ean_cache.stats()
+        for name in ('hits', 'misses'):
+            lines.append(f"# TYPE inventory_ean_cache_{name}_total counter")
+            lines.append(f"inventory_ean_cache_{name}_total "
+                         f"{cache_stats[name]}")
+        lines.append("# TYPE inventory_ean_cache_size gauge")
+        lines.append(f"inventory_ean_cache_size {cache_stats['size']}")
+
+        cache_stats = autocomplete_cache.stats()
+        for name in ('hits', 'narrowed', 'misses'):
+            lines.append(
+                f"# TYPE inventory_autocomplete_cache_{name}_total counter")
+            lines.append(f"inventory_autocomplete_cache_{name}_total "
+                         f"{cache_stats[name]}")
+        lines.append("# TYPE inventory_autocomplete_cache_size gauge")
+        lines.append(
+            f"inventory_autocomplete_cache_size {cache_stats['size']}")
+
+        event_stats = events.hub.stats()
+        for name in ('published', 'delivered', 'dropped'):
+            lines.append(f"# TYPE inventory_events_{name}_total counter")
+            lines.append(f"inventory_events_{name}_total {event_stats[name]}")
+        lines.append("# TYPE inventory_events_subscribers gauge")
+        lines.append(
+            f"inventory_events_subscribers {event_stats['subscribers']}")
+        return '\n'.join(lines) + '\n'
+
+
+aggregator = Aggregator()
+
+
+def _record_query(execute, sql, params, many, context):
+    measurements = _current.get()
+    if measurements is None:
+        return execute(sql, params, many, context)
+    start = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        measurements[0] += 1
+        measurements[1] += time.perf_counter() - start
+
+
+class MetricsMiddleware:
+    """Record latency, SQL queries and template time per view"""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        measurements = [0, 0.0, 0.0]
+        token = _current.set(measurements)
+        start = time.perf_counter()
+        try:
+            with connections['default'].execute_wrapper(_record_query):
+                response = self.get_response(request)
+        finally:
+            seconds = time.perf_counter() - start
+            _current.reset(token)
+            match = getattr(request, 'resolver_match', None)
+            aggregator.record(
+                match.view_name if match is not None else '<unresolved>',
+                seconds, *measurements)
+        return response
+
+
+class TimedTemplate:
+    """Wrapper of a Django template that measures its render time"""
+
+    def __init__(self, template):
+        self.template = template
+
+    @property
+    def origin(self):
+        return self.template.origin
+
+    def render(self, context=None, request=None):
+        measurements = _current.get()
+        if measurements is None:
+            return self.template.render(context, request)
+        start = time.perf_counter()
+        try:
+            return self.template.render(context, request)
+        finally:
+            measurements[2] += time.perf_counter() - start
+
+
+class TimedDjangoTemplates(DjangoTemplates):
+    """Django template backend that reports render time to the metrics"""
+
+    def from_string(self, template_code):
+        return TimedTemplate(super().from_string(template_code))
+
+    def get_template(self, template_name):
+        return TimedTemplate(super().get_template(template_name))
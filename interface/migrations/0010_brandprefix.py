@@ -0,0 +1,42 @@
+# Generated by Django 3.0.14 on 2026-10-18 19:16
+
+from django.db import migrations, models
+import django.db.models.deletion
+from django.db.models.functions import Substr
+
+
+def populate_brand_prefixes(apps, schema_editor):
+    Packaging = apps.get_model('interface', 'Packaging')
+    BrandPrefix = apps.get_model('interface', 'BrandPrefix')
+    rows = (Packaging.objects
+            .annotate(prefix=Substr('label', 1, 7))
+            .values_list('prefix', 'product__brand')
+            .distinct())
+    BrandPrefix.objects.bulk_create([
+        BrandPrefix(prefix=prefix, brand_id=brand)
+        for (prefix, brand) in rows.iterator()
+    ])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('interface', '0009_delete_brandean'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='BrandPrefix',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('prefix', models.CharField(max_length=7)),
+                ('brand', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='prefixes', to='interface.Brand')),
+            ],
+            options={
+                'verbose_name_plural': 'brand prefixes',
+                'unique_together': {('prefix', 'brand')},
+            },
+        ),
+        migrations.RunPython(populate_brand_prefixes,
+                             migrations.RunPython.noop),
+    ]
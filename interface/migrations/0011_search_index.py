@@ -0,0 +1,68 @@
+from django.db import migrations
+
+SQLITE_FORWARD = [
+    "CREATE VIRTUAL TABLE interface_product_search USING fts5("
+    "name, brand, tokenize='unicode61 remove_diacritics 2', prefix='2 3')",
+    "INSERT INTO interface_product_search (rowid, name, brand) "
+    "SELECT p.id, p.name, b.name FROM interface_product p "
+    "JOIN interface_brand b ON b.id = p.brand_id",
+    "CREATE VIRTUAL TABLE interface_genericproduct_search USING fts5("
+    "name, tokenize='unicode61 remove_diacritics 2', prefix='2 3')",
+    "INSERT INTO interface_genericproduct_search (rowid, name) "
+    "SELECT id, name FROM interface_genericproduct",
+    "CREATE INDEX interface_brand_name_nocase "
+    "ON interface_brand (name COLLATE NOCASE)",
+]
+
+SQLITE_BACKWARD = [
+    "DROP TABLE interface_product_search",
+    "DROP TABLE interface_genericproduct_search",
+    # Dropped by table rebuilds of later migrations
+    "DROP INDEX IF EXISTS interface_brand_name_nocase",
+]
+
+POSTGRESQL_FORWARD = [
+    "CREATE EXTENSION IF NOT EXISTS pg_trgm",
+    "CREATE INDEX interface_product_name_trgm "
+    "ON interface_product USING gin (UPPER(name::text) gin_trgm_ops)",
+    "CREATE INDEX interface_brand_name_trgm "
+    "ON interface_brand USING gin (UPPER(name::text) gin_trgm_ops)",
+    "CREATE INDEX interface_genericproduct_name_trgm "
+    "ON interface_genericproduct USING gin (UPPER(name::text) gin_trgm_ops)",
+    "CREATE INDEX interface_brand_name_upper_like "
+    "ON interface_brand (UPPER(name::text) text_pattern_ops)",
+]
+
+POSTGRESQL_BACKWARD = [
+    "DROP INDEX interface_product_name_trgm",
+    "DROP INDEX interface_brand_name_trgm",
+    "DROP INDEX interface_genericproduct_name_trgm",
+    "DROP INDEX interface_brand_name_upper_like",
+]
+
+
+def run_for_vendor(statements):
+    def run(apps, schema_editor):
+        for statement in statements.get(schema_editor.connection.vendor, []):
+            schema_editor.execute(statement)
+    return run
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('interface', '0010_brandprefix'),
+    ]
+
+    operations = [
+        migrations.RunPython(
+            run_for_vendor({
+                'sqlite': SQLITE_FORWARD,
+                'postgresql': POSTGRESQL_FORWARD,
+            }),
+            run_for_vendor({
+                'sqlite': SQLITE_BACKWARD,
+                'postgresql': POSTGRESQL_BACKWARD,
+            }),
+        ),
+    ]
@@ -0,0 +1,47 @@
+from django.db import migrations
+
+FORWARD = {
+    'sqlite': [
+        "CREATE INDEX interface_product_name_nocase "
+        "ON interface_product (name COLLATE NOCASE)",
+        "CREATE INDEX interface_genericproduct_name_nocase "
+        "ON interface_genericproduct (name COLLATE NOCASE)",
+    ],
+    'postgresql': [
+        "CREATE INDEX interface_product_name_upper_like "
+        "ON interface_product (UPPER(name::text) text_pattern_ops)",
+        "CREATE INDEX interface_genericproduct_name_upper_like "
+        "ON interface_genericproduct (UPPER(name::text) text_pattern_ops)",
+    ],
+}
+
+BACKWARD = {
+    'sqlite': [
+        # Dropped by table rebuilds of later migrations
+        "DROP INDEX IF EXISTS interface_product_name_nocase",
+        "DROP INDEX IF EXISTS interface_genericproduct_name_nocase",
+    ],
+    'postgresql': [
+        "DROP INDEX interface_product_name_upper_like",
+        "DROP INDEX interface_genericproduct_name_upper_like",
+    ],
+}
+
+
+def run_for_vendor(statements):
+    def run(apps, schema_editor):
+        for statement in statements.get(schema_editor.connection.vendor, []):
+            schema_editor.execute(statement)
+    return run
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('interface', '0012_stock_ledger'),
+    ]
+
+    operations = [
+        migrations.RunPython(run_for_vendor(FORWARD),
+                             run_for_vendor(BACKWARD)),
+    ]
@@ -0,0 +1,37 @@
+# Generated by Django 3.0.14 on 2026-10-18 19:33
+
+from django.db import migrations, models
+from django.db.models import Sum
+
+
+def compute_generic_stock(apps, schema_editor):
+    GenericProduct = apps.get_model('interface', 'GenericProduct')
+    Product = apps.get_model('interface', 'Product')
+    totals = (Product.objects.filter(generic_product__isnull=False)
+              .values('generic_product')
+              .annotate(total=Sum('count'))
+              .values_list('generic_product', 'total'))
+    for (pk, total) in totals:
+        GenericProduct.objects.filter(pk=pk).update(stock=total)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('interface', '0014_stocktake'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='genericproduct',
+            name='reorder_level',
+            field=models.PositiveIntegerField(blank=True, help_text='Reorder when the stock drops below this level.', null=True),
+        ),
+        migrations.AddField(
+            model_name='genericproduct',
+            name='stock',
+            field=models.IntegerField(default=0, editable=False),
+        ),
+        migrations.RunPython(compute_generic_stock,
+                             migrations.RunPython.noop),
+    ]
@@ -0,0 +1,24 @@
+# Generated by Django 3.0.14 on 2026-10-18 19:44
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('interface', '0016_catalog_version'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='catalogversion',
+            name='updated_at',
+            field=models.DateTimeField(default=django.utils.timezone.now),
+        ),
+        migrations.AddField(
+            model_name='genericproduct',
+            name='stock_version',
+            field=models.BigIntegerField(default=0, editable=False),
+        ),
+    ]
@@ -0,0 +1,31 @@
+# Generated by Django 3.0.14 on 2026-10-18 19:49
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('interface', '0017_conditional_get'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='product',
+            name='count_shards',
+            field=models.PositiveSmallIntegerField(default=0, help_text="Spread count updates of this busy product over this many rows, so scanners don't wait for each other. Use 0 to update the product itself."),
+        ),
+        migrations.CreateModel(
+            name='ProductCountShard',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('index', models.PositiveSmallIntegerField()),
+                ('count', models.PositiveIntegerField(default=0)),
+                ('product', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='shards', to='interface.Product')),
+            ],
+            options={
+                'unique_together': {('product', 'index')},
+            },
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 3.0.14 on 2026-10-18 20:13
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('interface', '0018_count_shards'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='productcountshard',
+            name='updates',
+            field=models.BigIntegerField(default=0, editable=False),
+        ),
+    ]
@@ -1,11 +1,30 @@
+import random
+import sqlite3
+import zlib
+from collections import defaultdict
+
+from django.conf import settings
 from django.core import validators
 from django.core.exceptions import ValidationError
-from django.db import models
+from django.db import connection, models, transaction
+from django.db.models import (Case, Count, ExpressionWrapper, F, OuterRef,
+                              Q, Subquery, Sum, Value, When)
+from django.db.models.functions import Coalesce, Substr
 from django.urls import reverse
+from django.utils import timezone
 
 from interface.fields import EANField
 
 
+def _can_return_from_update():
+    """Check if the database supports ``UPDATE ... RETURNING``"""
+    if connection.vendor == 'postgresql':
+        return True
+    if connection.vendor == 'sqlite':
+        return sqlite3.sqlite_version_info >= (3, 35)
+    return False
+
+
 class Brand(models.Model):
     """
     A specific brand, like "Douwe Egberts" or "Albert Heijn"
@@ -16,20 +35,24 @@ class Brand(models.Model):
         unique=True,
     )
 
-    @staticmethod
-    def get_brand_identifier(ean):
-        return ean[:7]
+    #: :class:`CatalogVersion` at which this was last saved
+    catalog_version = models.BigIntegerField(
+        default=0, db_index=True, editable=False)
+
+    #: Length of the brand identifier at the start of an EAN
+    BRAND_IDENTIFIER_LENGTH = 7
+
+    @classmethod
+    def get_brand_identifier(cls, ean):
+        return ean[:cls.BRAND_IDENTIFIER_LENGTH]
 
     @classmethod
     def by_ean(cls, ean):
         if not isinstance(ean, str):
             ean = str(ean)
 
-        pk = (cls.objects.all().filter(
-                  product__packaging__label__startswith=(
-                    cls.get_brand_identifier(ean)))
-              .values_list('pk').distinct()).get()
-        return cls.objects.get(pk=pk)
+        return cls.objects.get(
+            prefixes__prefix=cls.get_brand_identifier(ean))
 
     def __str__(self):
         return self.name
@@ -64,13 +87,246 @@ class Product(models.Model):
         blank=True,
     )
 
-    #: count
+    #: count. For products with :attr:`count_shards`, this is the folded
+    #: total, see :meth:`live_count`
     count = models.PositiveIntegerField(default=0)
 
+    #: Number of :class:`ProductCountShard` rows to spread count updates over
+    count_shards = models.PositiveSmallIntegerField(
+        default=0,
+        help_text="Spread count updates of this busy product over this many "
+                  "rows, so scanners don't wait for each other. "
+                  "Use 0 to update the product itself.",
+    )
+
+    #: :class:`CatalogVersion` at which this was last saved
+    catalog_version = models.BigIntegerField(
+        default=0, db_index=True, editable=False)
+
+    #: Number of products to update per statement when folding shards
+    UPDATE_BATCH_SIZE = 500
+
     @classmethod
     def by_ean(cls, ean):
         return cls.objects.get(packaging__label=ean)
 
+    @classmethod
+    def with_live_count(cls, queryset=None):
+        """
+        Annotate ``live_count``: :attr:`count` plus the counts in the shards
+        that were not folded yet.
+        """
+        if queryset is None:
+            queryset = cls.objects.all()
+        shards = (ProductCountShard.objects.filter(product=OuterRef('pk'))
+                  .values('product').annotate(total=Sum('count'))
+                  .values('total'))
+        return queryset.annotate(live_count=ExpressionWrapper(
+            F('count') + Coalesce(Subquery(shards), 0),
+            output_field=models.IntegerField(),
+        ))
+
+    @classmethod
+    def live_count(cls, pk):
+        """The current count of the product with ``pk``, including shards"""
+        return (cls.with_live_count().filter(pk=pk)
+                .values_list('live_count', flat=True).first())
+
+    @staticmethod
+    def pick_shard(shards, key=None):
+        """
+        Index of the shard to update out of ``shards``: always the same one
+        for ``key``, e.g. a scanning station, or a random one.
+        """
+        if key is None:
+            return random.randrange(shards)
+        return zlib.crc32(str(key).encode()) % shards
+
+    @classmethod
+    def adjust_count(cls, pk, delta, update_stock=True, shard=None):
+        """
+        Atomically add ``delta`` to the count of the product with ``pk``.
+
+        The update is a single ``UPDATE ... SET count = count + delta``
+        statement that only matches if the result is not negative, so
+        concurrent scanners can't lose updates. Unless ``update_stock`` is
+        false, :attr:`GenericProduct.stock` is adjusted in the same
+        transaction.
+
+        If ``shard`` is given, the :class:`ProductCountShard` with that
+        index is updated instead of the product row. The generic product's
+        stock is then adjusted when the shard is folded, see
+        :meth:`fold_counts`. If the shard does not exist (any more), or
+        does not hold enough to subtract ``-delta``, this falls back to
+        updating the product. Subtracting more than the product row holds
+        folds its shards first.
+
+        Returns the new count, including the shards, or ``None`` if the
+        product does not exist or the count would have become negative.
+        """
+        # Nothing to roll back to in the caller's transaction
+        with transaction.atomic(savepoint=False):
+            if shard is not None:
+                updated = (ProductCountShard.objects
+                           .filter(product=pk, index=shard, count__gte=-delta)
+                           .update(count=F('count') + delta,
+                                   updates=F('updates') + 1))
+                if updated:
+                    return cls.live_count(pk)
+            row = cls._adjust_count_row(pk, delta)
+            if row is None and delta < 0 and ProductCountShard.objects.filter(
+                    product=pk, count__gt=0).exists():
+                # The count may be spread over several shards
+                cls.fold_counts([pk])
+                row = cls._adjust_count_row(pk, delta)
+            if row is None:
+                return None
+            count, generic_product, shards = row
+            if update_stock:
+                GenericProduct.adjust_stock({generic_product: delta})
+        if shard is not None or shards:
+            # The shards hold more
+            return cls.live_count(pk)
+        return count
+
+    @classmethod
+    def _adjust_count_row(cls, pk, delta):
+        """The new count, generic product and count shards of ``pk``"""
+        if _can_return_from_update():
+            return cls._adjust_count_returning(pk, delta)
+        return cls._adjust_count_update(pk, delta)
+
+    @classmethod
+    def _adjust_count_update(cls, pk, delta):
+        updated = (cls.objects.filter(pk=pk, count__gte=-delta)
+                   .update(count=F('count') + delta))
+        if not updated:
+            return None
+        return cls.objects.values_list(
+            'count', 'generic_product', 'count_shards').get(pk=pk)
+
+    @classmethod
+    def _adjust_count_returning(cls, pk, delta):
+        qn = connection.ops.quote_name
+        table = qn(cls._meta.db_table)
+        count = qn(cls._meta.get_field('count').column)
+        generic_product = qn(cls._meta.get_field('generic_product').column)
+        shards = qn(cls._meta.get_field('count_shards').column)
+        pk_column = qn(cls._meta.pk.column)
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"UPDATE {table} SET {count} = {count} + %s "
+                f"WHERE {pk_column} = %s AND {count} + %s >= 0 "
+                f"RETURNING {count}, {generic_product}, {shards}",
+                [delta, pk, delta])
+            return cursor.fetchone()
+
+    @classmethod
+    def fold_counts(cls, pks=None):
+        """
+        Move the counts in the shards of the products with ``pks``, or of
+        all products, into :attr:`count` and :attr:`GenericProduct.stock`.
+
+        The folded shards are locked and emptied by subtracting what was
+        folded. Empty shards with an index beyond :attr:`count_shards` are
+        deleted.
+
+        Returns the number of products of which shards were folded.
+        """
+        shards = ProductCountShard.objects.all()
+        if pks is not None:
+            shards = shards.filter(product__in=pks)
+        with transaction.atomic():
+            rows = list(shards.filter(count__gt=0).select_for_update()
+                        .order_by('pk')
+                        .values_list('pk', 'product', 'count'))
+            totals = defaultdict(int)
+            for (_, product, count) in rows:
+                totals[product] += count
+            totals = sorted(totals.items())
+            stock = defaultdict(int)
+            for start in range(0, len(totals), cls.UPDATE_BATCH_SIZE):
+                batch = totals[start:start + cls.UPDATE_BATCH_SIZE]
+                products = cls.objects.filter(
+                    pk__in=[pk for (pk, _) in batch])
+                products.update(count=F('count') + Case(
+                    *[When(pk=pk, then=Value(total))
+                      for (pk, total) in batch],
+                    output_field=models.PositiveIntegerField(),
+                ))
+                generic_products = dict(
+                    products.values_list('pk', 'generic_product'))
+                for (pk, total) in batch:
+                    stock[generic_products[pk]] += total
+            for start in range(0, len(rows), cls.UPDATE_BATCH_SIZE):
+                batch = rows[start:start + cls.UPDATE_BATCH_SIZE]
+                ProductCountShard.objects.filter(
+                    pk__in=[pk for (pk, _, _) in batch]).update(
+                    count=F('count') - Case(
+                        *[When(pk=pk, then=Value(count))
+                          for (pk, _, count) in batch],
+                        output_field=models.PositiveIntegerField(),
+                    ))
+            surplus = shards.filter(count=0,
+                                    index__gte=F('product__count_shards'))
+            for generic_product in (surplus
+                                    .values_list('product__generic_product',
+                                                 flat=True).distinct()):
+                # The shard updates of the alternatives drop, see updates
+                stock.setdefault(generic_product, 0)
+            GenericProduct.adjust_stock(stock)
+            surplus.delete()
+        return len(totals)
+
+    @classmethod
+    def resize_shards(cls, pk, shards):
+        """
+        Create the shards of the product with ``pk`` up to ``shards``, and
+        fold and remove the ones beyond it.
+
+        Scanners that still use a removed shard fall back to updating the
+        product, so this can be done while scanning.
+        """
+        with transaction.atomic():
+            ProductCountShard.objects.bulk_create([
+                ProductCountShard(product_id=pk, index=index)
+                for index in range(shards)
+            ], ignore_conflicts=True)
+            cls.fold_counts([pk])
+
+    def stock_at(self, when):
+        """
+        Reconstruct the count of this product at time ``when``.
+
+        This starts from the last :class:`StockSnapshot` before ``when`` and
+        only adds the :class:`StockMovement` rows after it.
+        """
+        snapshot = (self.stocksnapshot_set.filter(taken_at__lte=when)
+                    .order_by('-taken_at').first())
+        movements = self.stockmovement_set.filter(created_at__lte=when)
+        count = 0
+        if snapshot is not None:
+            count = snapshot.count
+            movements = movements.filter(pk__gt=snapshot.last_movement_id)
+        return count + (movements.aggregate(total=Sum('delta'))['total'] or 0)
+
+    def save(self, *args, **kwargs):
+        """
+        Save the product. :attr:`count` is only written when the product is
+        created; after that it only changes with :meth:`adjust_count`, and
+        this instance may hold an outdated count.
+
+        The ``pre_save`` signal runs in the same transaction, so the stored
+        count it locks can't change before the stock is updated.
+        """
+        if (not self._state.adding and not kwargs.get('force_insert')
+                and kwargs.get('update_fields') is None):
+            kwargs['update_fields'] = [
+                field.name for field in self._meta.concrete_fields
+                if not field.primary_key and field.name != 'count']
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+
     def get_absolute_url(self):
         item = self.packaging_set.first()
         return reverse('interface:packaging', kwargs={'ean': item.label})
@@ -78,16 +334,51 @@ class Product(models.Model):
     def __str__(self):
         return f"{self.brand} {self.name}"
 
+    @classmethod
+    def brand_conflicts(cls, products):
+        """
+        Find products with EANs whose brand identifier is used by more than
+        one brand.
+
+        This does not use the :class:`BrandPrefix` index, but groups the
+        packagings themselves, so it also finds problems if the index is out
+        of date.
+
+        Returns a dict mapping product pks to sets of brand identifiers.
+        """
+        prefix = Substr('label', 1, Brand.BRAND_IDENTIFIER_LENGTH)
+        packagings = Packaging.objects.annotate(prefix=prefix)
+        shared = list(
+            packagings
+            .filter(prefix__in=packagings.filter(product__in=products)
+                    .values('prefix'))
+            .values('prefix')
+            .annotate(brands=Count('product__brand', distinct=True))
+            .filter(brands__gt=1)
+            .values_list('prefix', flat=True))
+        conflicts = defaultdict(set)
+        for (product, prefix) in (packagings
+                                  .filter(product__in=products,
+                                          prefix__in=shared)
+                                  .values_list('product', 'prefix')
+                                  .distinct()):
+            conflicts[product].add(prefix)
+        return dict(conflicts)
+
     def clean(self):
-        for item in self.packaging_set.all():
-            try:
-                brand = Brand.by_ean(item.label)
-            except Brand.MultipleObjectsReturned as e:
+        if self.pk is None:
+            return super().clean()
+
+        brands = BrandPrefix.brands_by_prefix(
+            Packaging.objects.filter(product=self))
+        for brand_ids in brands.values():
+            if len(brand_ids) > 1:
                 raise ValidationError({
                     'brand':
                     "More than one brand associated with this EAN?",
-                }) from e
-            if self.brand != brand:
+                })
+            if brand_ids != {self.brand_id}:
+                brand = Brand.objects.get(pk=brand_ids.pop())
                 raise ValidationError({
                     'brand':
                     f"{brand} is already associated with this EAN",
@@ -133,6 +424,10 @@ class Packaging(models.Model):
         on_delete=models.CASCADE,
     )
 
+    #: :class:`CatalogVersion` at which this was last saved
+    catalog_version = models.BigIntegerField(
+        default=0, db_index=True, editable=False)
+
     def __str__(self):
         label = f"Packaging for {self.count}x {self.product}"
         if self.description:
@@ -161,11 +456,537 @@ class Packaging(models.Model):
         return super().clean()
 
 
+class ProductCountShard(models.Model):
+    """
+    Part of the count of a :class:`Product` with
+    :attr:`~Product.count_shards`.
+
+    Scanners add to one of the shards of a busy product instead of all
+    updating the product row. The live count is :attr:`Product.count` plus
+    the shards, until :meth:`Product.fold_counts` moves them into the
+    product, e.g. from ``manage.py fold_counts``.
+    """
+
+    #: Product
+    product = models.ForeignKey(
+        Product,
+        on_delete=models.CASCADE,
+        related_name='shards',
+    )
+
+    #: Index of the shard, below :attr:`Product.count_shards`
+    index = models.PositiveSmallIntegerField()
+
+    #: Count added since the last fold
+    count = models.PositiveIntegerField(default=0)
+
+    #: Number of scans that updated this shard. Shard updates don't touch
+    #: :attr:`GenericProduct.stock_version`, so the packaging page adds up
+    #: the updates of the alternatives' shards to tell whether it changed
+    updates = models.BigIntegerField(default=0, editable=False)
+
+    class Meta:
+        unique_together = [('product', 'index')]
+
+    def __str__(self):
+        return f"{self.product_id}[{self.index}]: {self.count}"
+
+
 class GenericProduct(models.Model):
     """Generic version of a product, e.g. "coffee beans"."""
 
     #: name of the generic variants
     name = models.CharField(max_length=255)
 
+    #: Sum of :attr:`Product.count` of all products of this generic product.
+    #: Maintained incrementally, see :meth:`adjust_stock` and
+    #: :meth:`reconcile`. Shards are included when they are folded
+    stock = models.IntegerField(default=0, editable=False)
+
+    #: Incremented whenever the count of one of the products changes
+    stock_version = models.BigIntegerField(default=0, editable=False)
+
+    #: Threshold for the reorder report
+    reorder_level = models.PositiveIntegerField(
+        null=True,
+        blank=True,
+        help_text="Reorder when the stock drops below this level.",
+    )
+
+    #: Number of generic products to update per statement when reconciling
+    UPDATE_BATCH_SIZE = 500
+
+    @classmethod
+    def adjust_stock(cls, deltas):
+        """
+        Add the deltas in ``deltas``, a dict mapping generic product pks to
+        changes of :attr:`stock`, with a single ``UPDATE``.
+
+        This also increments :attr:`stock_version`, even if a delta is 0
+        because the counts of two products changed in opposite directions.
+        ``None`` keys (products without a generic product) are ignored.
+        """
+        deltas = {pk: delta for (pk, delta) in deltas.items()
+                  if pk is not None}
+        if not deltas:
+            return
+        if len(deltas) == 1:
+            [(pk, delta)] = deltas.items()
+            cls.objects.filter(pk=pk).update(
+                stock=F('stock') + delta,
+                stock_version=F('stock_version') + 1)
+            return
+        cls.objects.filter(pk__in=deltas).update(
+            stock=F('stock') + Case(
+                *[When(pk=pk, then=Value(delta))
+                  for (pk, delta) in sorted(deltas.items())],
+                output_field=models.IntegerField(),
+            ),
+            stock_version=F('stock_version') + 1,
+        )
+
+    @classmethod
+    def reconcile(cls):
+        """
+        Recompute :attr:`stock` of all generic products from the product
+        counts, with one ``GROUP BY`` query.
+
+        Returns the number of generic products of which the stock was wrong.
+        """
+        with transaction.atomic():
+            # Lock the aggregates first, so concurrent scans wait for us
+            stock = dict(cls.objects.select_for_update()
+                         .values_list('pk', 'stock'))
+            totals = dict(
+                Product.objects.filter(generic_product__isnull=False)
+                .values('generic_product')
+                .annotate(total=Sum('count'))
+                .values_list('generic_product', 'total'))
+            drifted = sorted(
+                (pk, totals.get(pk, 0)) for (pk, current) in stock.items()
+                if current != totals.get(pk, 0))
+            for start in range(0, len(drifted), cls.UPDATE_BATCH_SIZE):
+                batch = drifted[start:start + cls.UPDATE_BATCH_SIZE]
+                cls.objects.filter(pk__in=[pk for (pk, _) in batch]).update(
+                    stock=Case(
+                        *[When(pk=pk, then=Value(total))
+                          for (pk, total) in batch],
+                        output_field=models.IntegerField(),
+                    ),
+                    stock_version=F('stock_version') + 1,
+                )
+        return len(drifted)
+
     def __str__(self):
         return f"{self.name}"
+
+
+class BrandPrefix(models.Model):
+    """
+    Materialized index of the EAN brand identifiers in use by a :class:`Brand`.
+
+    Kept up to date from the :class:`Packaging` table by the signal handlers
+    in :mod:`interface.signals`, so :meth:`Brand.by_ean` is a single indexed
+    lookup instead of a join over all packagings.
+    """
+
+    #: Brand identifier, see :meth:`Brand.get_brand_identifier`
+    prefix = models.CharField(max_length=Brand.BRAND_IDENTIFIER_LENGTH)
+
+    #: Brand that has packagings with this prefix
+    brand = models.ForeignKey(
+        Brand,
+        on_delete=models.CASCADE,
+        related_name='prefixes',
+    )
+
+    class Meta:
+        unique_together = [('prefix', 'brand')]
+        verbose_name_plural = 'brand prefixes'
+
+    @classmethod
+    def refresh(cls, prefix):
+        """Recompute the brands associated with ``prefix``"""
+        # A range rather than startswith, so SQLite uses the label index.
+        # EANs are digits, and ':' sorts right after '9'.
+        brands = set(
+            Packaging.objects.filter(label__gte=prefix,
+                                     label__lt=prefix + ':')
+            .values_list('product__brand', flat=True))
+        with transaction.atomic():
+            cls.objects.filter(prefix=prefix).exclude(
+                brand__in=brands).delete()
+            existing = set(cls.objects.filter(prefix=prefix)
+                           .values_list('brand', flat=True))
+            # A concurrent refresh may add the same rows
+            cls.objects.bulk_create([
+                cls(prefix=prefix, brand_id=brand)
+                for brand in brands - existing
+            ], ignore_conflicts=True)
+
+    @classmethod
+    def brands_by_prefix(cls, packagings):
+        """
+        Look up the brands of the brand identifiers of ``packagings``.
+
+        Returns a dict mapping each brand identifier to a set of brand pks.
+        """
+        prefixes = packagings.annotate(prefix=Substr(
+            'label', 1, Brand.BRAND_IDENTIFIER_LENGTH)).values('prefix')
+        brands = defaultdict(set)
+        for (prefix, brand) in (cls.objects.filter(prefix__in=prefixes)
+                                .values_list('prefix', 'brand')):
+            brands[prefix].add(brand)
+        return dict(brands)
+
+    @classmethod
+    def rebuild(cls):
+        """Rebuild the whole index from the :class:`Packaging` table"""
+        rows = (Packaging.objects
+                .annotate(prefix=Substr(
+                    'label', 1, Brand.BRAND_IDENTIFIER_LENGTH))
+                .values_list('prefix', 'product__brand')
+                .distinct())
+        with transaction.atomic():
+            cls.objects.all().delete()
+            cls.objects.bulk_create([
+                cls(prefix=prefix, brand_id=brand)
+                for (prefix, brand) in rows.iterator()
+            ])
+
+    def __str__(self):
+        return f"{self.prefix} ({self.brand})"
+
+
+class StockMovement(models.Model):
+    """
+    Append-only ledger of changes to :attr:`Product.count`.
+
+    :attr:`Product.count` is the sum of all movements of a product; use
+    :meth:`Product.stock_at` to find the count at an earlier time.
+    """
+
+    #: Product of which the count changed
+    product = models.ForeignKey(Product, on_delete=models.CASCADE)
+
+    #: Packaging that was scanned, if any
+    packaging = models.ForeignKey(
+        Packaging,
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+    )
+
+    #: Change of the count
+    delta = models.IntegerField()
+
+    #: Who did it
+    user = models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+    )
+
+    #: When it happened
+    created_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['product', 'created_at']),
+        ]
+
+    def __str__(self):
+        return f"{self.delta:+d} {self.product_id} at {self.created_at}"
+
+
+class StockSnapshot(models.Model):
+    """
+    The count of a :class:`Product` after a given :class:`StockMovement`.
+
+    Snapshots are taken periodically by ``manage.py snapshot_stock``, so
+    reconstructing the count never needs to replay the whole ledger.
+    """
+
+    #: Product
+    product = models.ForeignKey(Product, on_delete=models.CASCADE)
+
+    #: Count after :attr:`last_movement_id`
+    count = models.IntegerField()
+
+    #: Primary key of the last :class:`StockMovement` included in the count
+    last_movement_id = models.BigIntegerField(default=0)
+
+    #: When the snapshot was taken
+    taken_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['product', 'taken_at']),
+        ]
+
+    @classmethod
+    def take(cls):
+        """
+        Take snapshots of all products that changed since their last
+        snapshot.
+
+        The new counts are computed from the previous snapshots and the
+        ledger, not from :attr:`Product.count`, so concurrent scans can't
+        make a snapshot inconsistent with the ledger. On PostgreSQL, scans
+        wait while the last movement is looked up, so call this outside of
+        a transaction.
+
+        Returns the number of snapshots taken.
+        """
+        last_movement_id = cls._last_committed_movement_id()
+        if last_movement_id is None:
+            return 0
+        taken_at = timezone.now()
+
+        latest = cls.objects.filter(
+            product=OuterRef('product')).order_by('-last_movement_id')
+        changes = (StockMovement.objects
+                   .filter(pk__lte=last_movement_id)
+                   .annotate(since=Coalesce(
+                       Subquery(latest.values('last_movement_id')[:1]), 0))
+                   .filter(pk__gt=F('since'))
+                   .values('product')
+                   .annotate(delta=Sum('delta'))
+                   .values_list('product', 'delta'))
+        changes = dict(changes)
+        previous = dict(
+            cls.objects.filter(
+                product__in=changes,
+                last_movement_id=Subquery(
+                    latest.values('last_movement_id')[:1]))
+            .values_list('product', 'count'))
+
+        cls.objects.bulk_create([
+            cls(product_id=product,
+                count=previous.get(product, 0) + delta,
+                last_movement_id=last_movement_id,
+                taken_at=taken_at)
+            for (product, delta) in changes.items()
+        ])
+        return len(changes)
+
+    @staticmethod
+    def _last_committed_movement_id():
+        """
+        The primary key up to which all movements are committed.
+
+        On PostgreSQL a scan that took a lower primary key from the sequence
+        may commit after a higher one, and would never be included in a
+        snapshot. So wait for the scans that are inserting movements, and
+        block new ones while reading the maximum.
+        """
+        with transaction.atomic():
+            if connection.vendor == 'postgresql':
+                table = connection.ops.quote_name(
+                    StockMovement._meta.db_table)
+                with connection.cursor() as cursor:
+                    cursor.execute(f"LOCK TABLE {table} IN SHARE MODE")
+            return (StockMovement.objects.order_by('-pk')
+                    .values_list('pk', flat=True).first())
+
+    def __str__(self):
+        return f"{self.product_id}: {self.count} at {self.taken_at}"
+
+
+class Stocktake(models.Model):
+    """
+    A stocktake session.
+
+    Scans are only recorded as :class:`StocktakeScan` rows while counting.
+    Committing the stocktake sets the count of every product to what was
+    counted, in one transaction.
+    """
+
+    #: Who started the stocktake
+    user = models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+    )
+
+    #: Whether all stock was counted, so that products that were not
+    #: scanned are out of stock
+    full = models.BooleanField(
+        default=False,
+        help_text="Set the count of products that weren't scanned to 0.",
+    )
+
+    #: When the stocktake was started
+    started_at = models.DateTimeField(default=timezone.now)
+
+    #: When the counts were applied
+    committed_at = models.DateTimeField(null=True, blank=True)
+
+    #: Number of product pks to update per statement when committing
+    UPDATE_BATCH_SIZE = 500
+
+    def discrepancies(self, lock=False):
+        """
+        Compare the counted products with their live count, see
+        :meth:`Product.with_live_count`.
+
+        Returns a list of ``(product pk, current count, counted)`` tuples for
+        all products of which the count is wrong.
+        """
+        counted = dict(
+            self.scans
+            .values('packaging__product')
+            .annotate(total=Sum(ExpressionWrapper(
+                F('quantity') * F('packaging__count'),
+                output_field=models.PositiveIntegerField(),
+            )))
+            .values_list('packaging__product', 'total'))
+        products = Product.objects.filter(
+            pk__in=self.scans.values('packaging__product'))
+        if self.full:
+            products = Product.objects.filter(
+                Q(pk__in=products.values('pk')) | Q(count__gt=0)
+                | Q(pk__in=ProductCountShard.objects.filter(count__gt=0)
+                    .values('product')))
+        if lock:
+            products = products.select_for_update()
+        return [
+            (pk, count, counted.get(pk, 0))
+            for (pk, count) in Product.with_live_count(products)
+            .order_by('pk').values_list('pk', 'live_count').iterator()
+            if count != counted.get(pk, 0)
+        ]
+
+    def commit(self, user=None):
+        """
+        Correct the counts of all products and record the corrections in
+        the stock ledger.
+
+        Returns the number of corrected products.
+        """
+        with transaction.atomic():
+            stocktake = (Stocktake.objects.select_for_update()
+                         .get(pk=self.pk))
+            if stocktake.committed_at is not None:
+                raise ValidationError("This stocktake was already committed")
+
+            # Apply the counts of busy products first, so the corrections
+            # below can't make Product.count negative
+            Product.fold_counts()
+            discrepancies = self.discrepancies(lock=True)
+            stock = defaultdict(int)
+            for start in range(0, len(discrepancies), self.UPDATE_BATCH_SIZE):
+                batch = discrepancies[start:start + self.UPDATE_BATCH_SIZE]
+                products = Product.objects.filter(
+                    pk__in=[pk for (pk, _, _) in batch])
+                generic_products = dict(
+                    products.values_list('pk', 'generic_product'))
+                # Correct by the difference, which leaves shards alone
+                products.update(count=F('count') + Case(
+                    *[When(pk=pk, then=Value(counted - count))
+                      for (pk, count, counted) in batch],
+                    output_field=models.IntegerField(),
+                ))
+                for (pk, count, counted) in batch:
+                    stock[generic_products[pk]] += counted - count
+            GenericProduct.adjust_stock(stock)
+            StockMovement.objects.bulk_create([
+                StockMovement(product_id=pk, delta=counted - count, user=user)
+                for (pk, count, counted) in discrepancies
+            ])
+
+            self.committed_at = timezone.now()
+            self.save(update_fields=['committed_at'])
+        return len(discrepancies)
+
+    def __str__(self):
+        return f"Stocktake of {self.started_at:%Y-%m-%d %H:%M}"
+
+
+class StocktakeScan(models.Model):
+    """A packaging counted during a :class:`Stocktake`"""
+
+    #: Stocktake session
+    stocktake = models.ForeignKey(
+        Stocktake,
+        on_delete=models.CASCADE,
+        related_name='scans',
+    )
+
+    #: Packaging that was scanned
+    packaging = models.ForeignKey(Packaging, on_delete=models.CASCADE)
+
+    #: Number of packages
+    quantity = models.PositiveIntegerField(default=1)
+
+
+class CatalogVersion(models.Model):
+    """
+    Counter that increases with every change to the catalog: brands,
+    products, packagings and generic products.
+
+    Changed rows store the new version in their ``catalog_version``, and
+    deletions are recorded as :class:`CatalogDeletion`, so clients can fetch
+    everything that changed since the version they have.
+    """
+
+    #: Current version
+    value = models.BigIntegerField(default=0)
+
+    #: When the catalog last changed
+    updated_at = models.DateTimeField(default=timezone.now)
+
+    @classmethod
+    def current(cls):
+        return (cls.objects.filter(pk=1).values_list('value', flat=True)
+                .first() or 0)
+
+    @classmethod
+    def last_change(cls):
+        """The current ``(value, updated_at)``"""
+        return (cls.objects.filter(pk=1).values_list('value', 'updated_at')
+                .first() or (0, None))
+
+    @classmethod
+    def next(cls):
+        """
+        Increment the version and return it.
+
+        The counter stays locked until the transaction commits, so versions
+        become visible in order. Call this inside ``transaction.atomic()``,
+        in the same transaction as the change it is for.
+        """
+        now = timezone.now()
+        if not cls.objects.filter(pk=1).update(value=F('value') + 1,
+                                               updated_at=now):
+            cls.objects.get_or_create(pk=1)
+            cls.objects.filter(pk=1).update(value=F('value') + 1,
+                                            updated_at=now)
+        return cls.objects.values_list('value', flat=True).get(pk=1)
+
+    def __str__(self):
+        return f"Catalog version {self.value}"
+
+
+class CatalogDeletion(models.Model):
+    """A brand, product or packaging that was deleted from the catalog"""
+
+    KIND_CHOICES = [
+        ('brand', 'Brand'),
+        ('product', 'Product'),
+        ('packaging', 'Packaging'),
+    ]
+
+    #: :class:`CatalogVersion` of the deletion
+    catalog_version = models.BigIntegerField(db_index=True)
+
+    #: What was deleted
+    kind = models.CharField(max_length=16, choices=KIND_CHOICES)
+
+    #: Primary key of the deleted object
+    object_id = models.IntegerField()
+
+    def __str__(self):
+        return f"Deleted {self.kind} {self.object_id}"
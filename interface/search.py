@@ -0,0 +1,252 @@
+"""
+Search indexes for the autocomplete views.
+
+On SQLite the product and generic product names are kept in FTS5 tables,
+which the signal handlers in :mod:`interface.signals` keep up to date.
+On PostgreSQL the names have ``pg_trgm`` GIN indexes, which the database
+maintains itself. Other databases fall back to ``icontains`` queries.
+
+Both indexes are created by migration ``0011_search_index``. SQLite
+rebuilds a table to alter it, which drops the indexes Django doesn't know
+about, so :data:`SQLITE_INDEXES` are re-created after every ``migrate``.
+"""
+import re
+import unicodedata
+
+from django.contrib.postgres.search import TrigramSimilarity
+from django.db import connection
+from django.db.migrations.recorder import MigrationRecorder
+from django.db.models import Case, IntegerField, Q, When
+from django.db.models.functions import Greatest
+
+from interface.models import GenericProduct, Product
+
+#: Upper bound on the number of autocomplete results
+MAX_RESULTS = 20
+
+PRODUCT_TABLE = 'interface_product_search'
+GENERIC_PRODUCT_TABLE = 'interface_genericproduct_search'
+
+#: Raw SQL indexes on SQLite, by the migration that creates them
+SQLITE_INDEXES = {
+    ('interface', '0011_search_index'): [
+        "CREATE INDEX IF NOT EXISTS interface_brand_name_nocase "
+        "ON interface_brand (name COLLATE NOCASE)",
+    ],
+    ('interface', '0013_name_prefix_indexes'): [
+        "CREATE INDEX IF NOT EXISTS interface_product_name_nocase "
+        "ON interface_product (name COLLATE NOCASE)",
+        "CREATE INDEX IF NOT EXISTS interface_genericproduct_name_nocase "
+        "ON interface_genericproduct (name COLLATE NOCASE)",
+    ],
+}
+
+
+def restore_sqlite_indexes(connection):
+    """Re-create the :data:`SQLITE_INDEXES` that a table rebuild dropped"""
+    if connection.vendor != 'sqlite':
+        return
+    applied = MigrationRecorder(connection).applied_migrations()
+    with connection.cursor() as cursor:
+        for (migration, statements) in SQLITE_INDEXES.items():
+            if migration in applied:
+                for statement in statements:
+                    cursor.execute(statement)
+
+
+def _use_fts():
+    return connection.vendor == 'sqlite'
+
+
+def _match_expression(query):
+    """Turn user input into an FTS5 query matching all word prefixes"""
+    return ' '.join(f'"{word}"*' for word in re.findall(r'\w+', query))
+
+
+def _words(text):
+    """Words of ``text`` ignoring case and accents, like the FTS5 tokenizer"""
+    text = unicodedata.normalize('NFKD', text.lower())
+    return re.findall(r'\w+', ''.join(
+        c for c in text if not unicodedata.combining(c)))
+
+
+def _matches(query, *texts):
+    """Whether any of ``texts`` matches ``query`` like the search does"""
+    if _use_fts():
+        words = _words(query)
+        tokens = [token for text in texts for token in _words(text)]
+        return bool(words) and all(
+            any(token.startswith(word) for token in tokens)
+            for word in words)
+    query = query.lower()
+    return any(query in text.lower() for text in texts)
+
+
+def product_matches(query, product):
+    """Whether :func:`search_products` finds ``product`` for ``query``"""
+    return _matches(query, product.name, product.brand.name)
+
+
+def generic_product_matches(query, generic_product):
+    """Whether :func:`search_generic_products` finds ``generic_product``"""
+    return _matches(query, generic_product.name)
+
+
+def in_order(queryset, pks):
+    """Filter ``queryset`` to ``pks``, keeping the order of ``pks``"""
+    if not pks:
+        return queryset.none()
+    return queryset.filter(pk__in=pks).order_by(Case(
+        *[When(pk=pk, then=position) for (position, pk) in enumerate(pks)],
+        output_field=IntegerField(),
+    ))
+
+
+def search_products(query, brand=None, limit=MAX_RESULTS):
+    """Find products by (brand) name, best matches first"""
+    queryset = Product.objects.select_related('brand')
+    if _use_fts():
+        match = _match_expression(query)
+        if not match:
+            return queryset.none()
+        sql = (f"SELECT s.rowid FROM {PRODUCT_TABLE} s "
+               f"JOIN interface_product p ON p.id = s.rowid "
+               f"WHERE {PRODUCT_TABLE} MATCH %s")
+        params = [match]
+        if brand:
+            sql += " AND p.brand_id = %s"
+            params.append(brand)
+        sql += " ORDER BY rank LIMIT %s"
+        params.append(limit)
+        with connection.cursor() as cursor:
+            cursor.execute(sql, params)
+            pks = [pk for (pk,) in cursor.fetchall()]
+        return in_order(queryset, pks)
+
+    if brand:
+        queryset = queryset.filter(brand=brand)
+    queryset = queryset.filter(
+        Q(name__icontains=query) | Q(brand__name__icontains=query))
+    if connection.vendor == 'postgresql':
+        queryset = queryset.annotate(rank=Greatest(
+            TrigramSimilarity('name', query),
+            TrigramSimilarity('brand__name', query),
+        )).order_by('-rank', 'name')
+    else:
+        queryset = queryset.order_by('name')
+    return in_order(queryset,
+                    list(queryset.values_list('pk', flat=True)[:limit]))
+
+
+def search_generic_products(query, limit=MAX_RESULTS):
+    """Find generic products by name, best matches first"""
+    queryset = GenericProduct.objects.all()
+    if _use_fts():
+        match = _match_expression(query)
+        if not match:
+            return queryset.none()
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"SELECT rowid FROM {GENERIC_PRODUCT_TABLE} "
+                f"WHERE {GENERIC_PRODUCT_TABLE} MATCH %s "
+                f"ORDER BY rank LIMIT %s",
+                [match, limit])
+            pks = [pk for (pk,) in cursor.fetchall()]
+        return in_order(queryset, pks)
+
+    queryset = queryset.filter(name__icontains=query)
+    if connection.vendor == 'postgresql':
+        queryset = queryset.annotate(
+            rank=TrigramSimilarity('name', query)).order_by('-rank', 'name')
+    else:
+        queryset = queryset.order_by('name')
+    return in_order(queryset,
+                    list(queryset.values_list('pk', flat=True)[:limit]))
+
+
+def index_product(pk):
+    index_products([pk])
+
+
+def index_products(pks):
+    if not _use_fts() or not pks:
+        return
+    placeholders = ', '.join(['%s'] * len(pks))
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"DELETE FROM {PRODUCT_TABLE} WHERE rowid IN ({placeholders})",
+            list(pks))
+        cursor.execute(
+            f"INSERT INTO {PRODUCT_TABLE} (rowid, name, brand) "
+            f"SELECT p.id, p.name, b.name FROM interface_product p "
+            f"JOIN interface_brand b ON b.id = p.brand_id "
+            f"WHERE p.id IN ({placeholders})",
+            list(pks))
+
+
+def unindex_product(pk):
+    if not _use_fts():
+        return
+    with connection.cursor() as cursor:
+        cursor.execute(f"DELETE FROM {PRODUCT_TABLE} WHERE rowid = %s", [pk])
+
+
+def index_brand(pk):
+    """Reindex all products of a brand, e.g. after it was renamed"""
+    if not _use_fts():
+        return
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"DELETE FROM {PRODUCT_TABLE} WHERE rowid IN "
+            f"(SELECT id FROM interface_product WHERE brand_id = %s)",
+            [pk])
+        cursor.execute(
+            f"INSERT INTO {PRODUCT_TABLE} (rowid, name, brand) "
+            f"SELECT p.id, p.name, b.name FROM interface_product p "
+            f"JOIN interface_brand b ON b.id = p.brand_id "
+            f"WHERE b.id = %s",
+            [pk])
+
+
+def index_generic_product(pk):
+    index_generic_products([pk])
+
+
+def index_generic_products(pks):
+    if not _use_fts() or not pks:
+        return
+    placeholders = ', '.join(['%s'] * len(pks))
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"DELETE FROM {GENERIC_PRODUCT_TABLE} "
+            f"WHERE rowid IN ({placeholders})",
+            list(pks))
+        cursor.execute(
+            f"INSERT INTO {GENERIC_PRODUCT_TABLE} (rowid, name) "
+            f"SELECT id, name FROM interface_genericproduct "
+            f"WHERE id IN ({placeholders})",
+            list(pks))
+
+
+def unindex_generic_product(pk):
+    if not _use_fts():
+        return
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"DELETE FROM {GENERIC_PRODUCT_TABLE} WHERE rowid = %s", [pk])
+
+
+def rebuild():
+    """Rebuild the FTS tables from scratch"""
+    if not _use_fts():
+        return
+    with connection.cursor() as cursor:
+        cursor.execute(f"DELETE FROM {PRODUCT_TABLE}")
+        cursor.execute(
+            f"INSERT INTO {PRODUCT_TABLE} (rowid, name, brand) "
+            f"SELECT p.id, p.name, b.name FROM interface_product p "
+            f"JOIN interface_brand b ON b.id = p.brand_id")
+        cursor.execute(f"DELETE FROM {GENERIC_PRODUCT_TABLE}")
+        cursor.execute(
+            f"INSERT INTO {GENERIC_PRODUCT_TABLE} (rowid, name) "
+            f"SELECT id, name FROM interface_genericproduct")
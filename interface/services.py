@@ -0,0 +1,129 @@
+from collections import defaultdict
+
+from django.core.exceptions import ValidationError
+from django.db import transaction
+from django.urls import reverse
+
+from interface import ean as ean_codec
+from interface import events
+from interface.models import (GenericProduct, Packaging, Product,
+                              StockMovement)
+from interface.validators import ean_validator
+
+#: Scan actions and the sign of the count change they cause
+ACTIONS = {
+    'add': 1,
+    'subtract': -1,
+}
+
+
+def _parse_scan(scan):
+    """Normalize one ``(ean, action, quantity)`` record"""
+    if isinstance(scan, dict):
+        ean = scan.get('ean')
+        action = scan.get('action', 'add')
+        quantity = scan.get('quantity', 1)
+    else:
+        try:
+            ean, action, quantity = scan
+        except (TypeError, ValueError) as e:
+            raise ValidationError("Expected (ean, action, quantity)") from e
+
+    if not isinstance(ean, (str, int)):
+        raise ValidationError(f"bad EAN: {ean!r}")
+    ean = ean_codec.compact(str(ean))
+    ean_validator(ean)
+    if action not in ACTIONS:
+        raise ValidationError(f"bad action: {action!r}")
+    if (not isinstance(quantity, int) or isinstance(quantity, bool)
+            or quantity < 1):
+        raise ValidationError(f"bad quantity: {quantity!r}")
+    return ean, action, quantity
+
+
+def apply_scans(scans, user=None):
+    """
+    Apply a batch of buffered scans.
+
+    All EANs are resolved with a single query, the count changes are summed
+    per :class:`~interface.models.Product` and applied in one transaction.
+    If the summed change would make a product's count negative, its scans
+    are applied one by one in order instead, and only the scans that would
+    make the count negative are rejected. Applied scans are recorded in the
+    :class:`~interface.models.StockMovement` ledger, and the new counts are
+    published to open packaging pages.
+
+    Returns a result dict for every scan, in the same order.
+    """
+    results = []
+    parsed = {}
+    for index, scan in enumerate(scans):
+        try:
+            ean, action, quantity = _parse_scan(scan)
+        except ValidationError as e:
+            results.append({'status': 'invalid', 'error': e.messages[0]})
+            continue
+        results.append({'ean': ean, 'action': action, 'quantity': quantity})
+        parsed[index] = (ean, action, quantity)
+
+    packagings = {}
+    generic_products = {}
+    for (label, pk, product, count, generic_product) in (
+            Packaging.objects.filter(
+                label__in={ean for (ean, _, _) in parsed.values()})
+            .values_list('label', 'pk', 'product', 'count',
+                         'product__generic_product')):
+        packagings[label] = (pk, product, count)
+        generic_products[product] = generic_product
+
+    deltas = defaultdict(int)
+    scans_by_product = defaultdict(list)
+    for index, (ean, action, quantity) in parsed.items():
+        result = results[index]
+        if ean not in packagings:
+            result['status'] = 'unknown'
+            result['url'] = reverse('interface:select_product_for_packaging',
+                                    kwargs={'ean': ean})
+            continue
+        packaging, product, count = packagings[ean]
+        result['product'] = product
+        delta = ACTIONS[action] * count * quantity
+        deltas[product] += delta
+        scans_by_product[product].append(
+            (result, StockMovement(product_id=product, packaging_id=packaging,
+                                   delta=delta, user=user)))
+
+    movements = []
+    stock = defaultdict(int)
+    with transaction.atomic():
+        # Update in a fixed order so concurrent batches don't deadlock, and
+        # only update the generic products after all products
+        for product in sorted(deltas):
+            scans = scans_by_product[product]
+            count = Product.adjust_count(product, deltas[product],
+                                         update_stock=False)
+            if count is not None:
+                counts = [count] * len(scans)
+            else:
+                # Reject only the scans that take more than there is
+                counts = [Product.adjust_count(product, movement.delta,
+                                               update_stock=False)
+                          for (_, movement) in scans]
+            applied = None
+            for ((result, movement), count) in zip(scans, counts):
+                if count is None:
+                    result['status'] = 'error'
+                    result['error'] = "We can't have negative counts!"
+                else:
+                    result['status'] = 'ok'
+                    result['count'] = applied = count
+                    stock[generic_products[product]] += movement.delta
+                    movements.append(movement)
+            if applied is not None:
+                transaction.on_commit(
+                    lambda product=product, count=applied:
+                    events.hub.publish(product, count))
+        GenericProduct.adjust_stock(stock)
+        StockMovement.objects.bulk_create(movements)
+
+    return results
@@ -0,0 +1,203 @@
+from collections import defaultdict
+
+from django.conf import settings
+from django.db import connections, transaction
+from django.db.backends.signals import connection_created
+from django.db.models.signals import (post_delete, post_migrate, post_save,
+                                      pre_save)
+from django.dispatch import receiver
+
+from interface import search
+from interface.cache import ean_cache
+from interface.models import (Brand, BrandPrefix, CatalogDeletion,
+                              CatalogVersion, GenericProduct, Packaging,
+                              Product)
+
+
+@receiver(connection_created)
+def configure_sqlite(sender, connection, **kwargs):
+    if connection.vendor != 'sqlite':
+        return
+    with connection.cursor() as cursor:
+        for (pragma, value) in getattr(settings, 'SQLITE_PRAGMAS', {}).items():
+            cursor.execute(f"PRAGMA {pragma} = {value}")
+
+
+@receiver(post_migrate)
+def restore_search_indexes(sender, using, **kwargs):
+    if sender.name == 'interface':
+        search.restore_sqlite_indexes(connections[using])
+
+
+@receiver(pre_save, sender=Packaging)
+def remember_packaging_label(sender, instance, **kwargs):
+    """Remember the stored label so we can clean up if it changed"""
+    instance._old_label = None
+    if instance.pk is not None:
+        instance._old_label = (sender.objects.filter(pk=instance.pk)
+                               .values_list('label', flat=True).first())
+
+
+@receiver(post_save, sender=Packaging)
+@receiver(post_delete, sender=Packaging)
+def update_brand_prefix(sender, instance, **kwargs):
+    prefix = Brand.get_brand_identifier(instance.label)
+    BrandPrefix.refresh(prefix)
+    old_label = getattr(instance, '_old_label', None)
+    if old_label is not None:
+        old_prefix = Brand.get_brand_identifier(old_label)
+        if old_prefix != prefix:
+            BrandPrefix.refresh(old_prefix)
+
+
+@receiver(post_save, sender=Packaging)
+@receiver(post_delete, sender=Packaging)
+def invalidate_packaging_ean(sender, instance, **kwargs):
+    # Before the commit, a concurrent lookup could cache the old row again
+    labels = {instance.label, getattr(instance, '_old_label', None)}
+    labels.discard(None)
+
+    def invalidate():
+        for label in labels:
+            ean_cache.invalidate(label)
+    transaction.on_commit(invalidate)
+
+
+@receiver(pre_save, sender=Product)
+def remember_product_stock(sender, instance, **kwargs):
+    """
+    Remember the stored generic product and count for the stock. The row is
+    locked until the save commits, so concurrent scans can't change the
+    count in between, see Product.save.
+    """
+    instance._old_stock = None
+    if instance.pk is not None:
+        instance._old_stock = (sender.objects.select_for_update()
+                               .filter(pk=instance.pk)
+                               .values_list('generic_product', 'count')
+                               .first())
+
+
+@receiver(post_save, sender=Product)
+def update_generic_stock(sender, instance, update_fields, **kwargs):
+    if (update_fields is not None
+            and not {'generic_product', 'count'} & set(update_fields)):
+        return
+    stock = defaultdict(int)
+    count = instance.count
+    old_stock = getattr(instance, '_old_stock', None)
+    if old_stock is not None:
+        old_generic_product, old_count = old_stock
+        stock[old_generic_product] -= old_count
+        if update_fields is not None and 'count' not in update_fields:
+            # The count wasn't saved, see Product.save
+            count = old_count
+    stock[instance.generic_product_id] += count
+    GenericProduct.adjust_stock(stock)
+
+
+@receiver(post_delete, sender=Product)
+def remove_generic_stock(sender, instance, **kwargs):
+    GenericProduct.adjust_stock({instance.generic_product_id: -instance.count})
+
+
+@receiver(post_save, sender=Product)
+def resize_count_shards(sender, instance, update_fields, **kwargs):
+    """Switch a product to or from sharded counts"""
+    if update_fields is not None and 'count_shards' not in update_fields:
+        return
+    if instance.shards.count() != instance.count_shards:
+        Product.resize_shards(instance.pk, instance.count_shards)
+
+
+@receiver(pre_save, sender=Product)
+def remember_product_brand(sender, instance, **kwargs):
+    """Remember the stored brand so we only refresh prefixes if it changed"""
+    instance._old_brand = None
+    if instance.pk is not None:
+        instance._old_brand = (sender.objects.filter(pk=instance.pk)
+                               .values_list('brand', flat=True).first())
+
+
+@receiver(post_save, sender=Product)
+def update_product_brand_prefixes(sender, instance, created, **kwargs):
+    """A product may have been moved to another brand"""
+    old_brand = getattr(instance, '_old_brand', None)
+    if created or old_brand is None or old_brand == instance.brand_id:
+        return
+    prefixes = {
+        Brand.get_brand_identifier(label)
+        for label in instance.packaging_set.values_list('label', flat=True)
+    }
+    for prefix in prefixes:
+        BrandPrefix.refresh(prefix)
+
+
+@receiver(post_save, sender=Product)
+@receiver(post_delete, sender=Product)
+def invalidate_product_eans(sender, instance, created=False, **kwargs):
+    if created:
+        return
+    if ean_cache.backend is not None and instance.pk is not None:
+        # Only the shared cache needs the EANs, the local one can scan
+        eans = list(instance.packaging_set.values_list('label', flat=True))
+    else:
+        eans = ()
+    pk = instance.pk
+    transaction.on_commit(lambda: ean_cache.invalidate_product(pk, eans))
+
+
+@receiver(post_save, sender=Product)
+def index_product(sender, instance, **kwargs):
+    search.index_product(instance.pk)
+
+
+@receiver(post_delete, sender=Product)
+def unindex_product(sender, instance, **kwargs):
+    search.unindex_product(instance.pk)
+
+
+@receiver(post_save, sender=Brand)
+def index_brand(sender, instance, created, **kwargs):
+    if not created:
+        search.index_brand(instance.pk)
+
+
+@receiver(post_save, sender=GenericProduct)
+def index_generic_product(sender, instance, **kwargs):
+    search.index_generic_product(instance.pk)
+
+
+@receiver(post_delete, sender=GenericProduct)
+def unindex_generic_product(sender, instance, **kwargs):
+    search.unindex_generic_product(instance.pk)
+
+
+@receiver(post_save, sender=Brand)
+@receiver(post_save, sender=Product)
+@receiver(post_save, sender=Packaging)
+def update_catalog_version(sender, instance, **kwargs):
+    with transaction.atomic():
+        instance.catalog_version = CatalogVersion.next()
+        sender.objects.filter(pk=instance.pk).update(
+            catalog_version=instance.catalog_version)
+
+
+@receiver(post_save, sender=GenericProduct)
+@receiver(post_delete, sender=GenericProduct)
+def update_generic_catalog_version(sender, instance, **kwargs):
+    """Generic products are not synced, but they are autocompleted"""
+    with transaction.atomic():
+        CatalogVersion.next()
+
+
+@receiver(post_delete, sender=Brand)
+@receiver(post_delete, sender=Product)
+@receiver(post_delete, sender=Packaging)
+def record_catalog_deletion(sender, instance, **kwargs):
+    with transaction.atomic():
+        CatalogDeletion.objects.create(
+            catalog_version=CatalogVersion.next(),
+            kind=sender._meta.model_name,
+            object_id=instance.pk,
+        )
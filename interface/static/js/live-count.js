@@ -0,0 +1,22 @@
+// Update the counts on a packaging page when other stations scan
+
+(function() {
+    var list = document.querySelector('[data-events-url]');
+    if (!list || !window.EventSource) {
+        return;
+    }
+    // Changes may arrive out of order from different processes
+    var latest = {};
+    var source = new EventSource(list.dataset.eventsUrl);
+    source.addEventListener('count', function(event) {
+        var change = JSON.parse(event.data);
+        if (latest[change.product] > change.at) {
+            return;
+        }
+        latest[change.product] = change.at;
+        document.querySelectorAll('[data-live-count="' + change.product + '"]')
+            .forEach(function(element) {
+                element.textContent = change.count;
+            });
+    });
+})();
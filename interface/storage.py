@@ -0,0 +1,56 @@
+import gzip
+import io
+
+from django.contrib.staticfiles.storage import ManifestStaticFilesStorage
+from django.core.files.base import ContentFile
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+
+class CompressedManifestStaticFilesStorage(ManifestStaticFilesStorage):
+    """
+    Fingerprinted static files with precompressed variants.
+
+    Next to every hashed file, ``collectstatic`` writes a ``.gz`` file and,
+    if the ``brotli`` package is installed, a ``.br`` file, so the web server
+    can serve them with far-future cache headers without compressing them
+    on every request.
+    """
+
+    #: Extensions of the files that are worth compressing
+    compressed_extensions = ('.css', '.js', '.map', '.svg', '.txt')
+
+    #: Files smaller than this are not compressed
+    min_compress_size = 512
+
+    def post_process(self, paths, dry_run=False, **options):
+        yield from super().post_process(paths, dry_run, **options)
+        if dry_run:
+            return
+        for name in sorted(set(self.hashed_files.values())):
+            if name.endswith(self.compressed_extensions):
+                self._compress(name)
+
+    def _compress(self, name):
+        with self.open(name) as f:
+            content = f.read()
+        if len(content) < self.min_compress_size:
+            return
+
+        buffer = io.BytesIO()
+        # A fixed mtime keeps the output the same for the same input
+        with gzip.GzipFile(fileobj=buffer, mode='wb', mtime=0) as f:
+            f.write(content)
+        variants = {'.gz': buffer.getvalue()}
+        if brotli is not None:
+            variants['.br'] = brotli.compress(content)
+        for (extension, compressed) in variants.items():
+            if len(compressed) >= len(content):
+                continue
+            compressed_name = name + extension
+            if self.exists(compressed_name):
+                self.delete(compressed_name)
+            self._save(compressed_name, ContentFile(compressed))
@@ -1,3 +1,574 @@
-#  from django.test import TestCase
+import io
+import os
+from datetime import timedelta
+from unittest import skipUnless
 
-# Create your tests here.
+from django.contrib.auth import get_user_model
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.db import connection, transaction
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from interface import catalog, decode, services
+from interface.cache import (AutocompleteCache, EANCache, Resolution,
+                             autocomplete_cache, ean_cache)
+from interface.management.commands.benchmark import (BUDGETS, make_cases,
+                                                     populate)
+from interface.models import (Brand, BrandPrefix, GenericProduct,
+                              Packaging, Product, StockMovement,
+                              StockSnapshot)
+
+
+# There is no manifest without collectstatic
+@override_settings(STATICFILES_STORAGE=(
+    'django.contrib.staticfiles.storage.StaticFilesStorage'))
+class QueryBudgetTests(TransactionTestCase):
+    """
+    The query budgets of ``manage.py benchmark``, on a small catalog.
+
+    Transactions are committed like in production, so the queries are the
+    same as the benchmark's.
+    """
+
+    def setUp(self):
+        ean_cache.clear()
+        autocomplete_cache.clear()
+        populate(200)
+        self.user = get_user_model().objects.create_user('budget')
+
+    def test_query_budgets(self):
+        for (name, case) in make_cases(self.user).items():
+            with self.subTest(name):
+                case(0)  # warm up caches
+                with CaptureQueriesContext(connection) as captured:
+                    case(1)
+                self.assertLessEqual(len(captured), BUDGETS[name][0],
+                                     [q['sql'] for q in captured])
+
+
+#: Modules of the L-code of the digits 0-9, R-codes are the inverse and
+#: G-codes the reversed R-codes
+L_CODES = ('0001101', '0011001', '0010011', '0111101', '0100011',
+           '0110001', '0101111', '0111011', '0110111', '0001011')
+
+
+def barcode_image(ean, module=3, height=60):
+    """A PIL image of the EAN-13 or EAN-8 barcode of ``ean``"""
+    from PIL import Image
+
+    def r_code(digit):
+        return ''.join('1' if bit == '0' else '0' for bit in L_CODES[digit])
+
+    digits = [int(digit) for digit in ean]
+    if len(digits) == 13:
+        parity = {first: parity
+                  for (parity, first) in decode.FIRST_DIGITS.items()}[ean[0]]
+        digits = digits[1:]
+    else:
+        parity = 'L' * 4
+    half = len(digits) // 2
+    modules = '101' + ''.join(
+        L_CODES[digit] if code == 'L' else r_code(digit)[::-1]
+        for (digit, code) in zip(digits[:half], parity))
+    modules += '01010' + ''.join(r_code(digit) for digit in digits[half:])
+    modules = '0' * 10 + modules + '101' + '0' * 10
+
+    image = Image.new('L', (len(modules) * module, height), 255)
+    for (index, bit) in enumerate(modules):
+        if bit == '1':
+            image.paste(0, (index * module, 0, (index + 1) * module, height))
+    return image
+
+
+def png(image):
+    buffer = io.BytesIO()
+    image.save(buffer, 'PNG')
+    return buffer.getvalue()
+
+
+@skipUnless(decode.AVAILABLE, "Decoding barcodes needs NumPy and Pillow")
+class DecodeTests(TestCase):
+    def test_ean13(self):
+        self.assertEqual(decode.decode(barcode_image('4006381333931')),
+                         ['4006381333931'])
+
+    def test_ean8(self):
+        self.assertEqual(decode.decode(barcode_image('96385074')),
+                         ['96385074'])
+
+    def test_rotated(self):
+        image = barcode_image('4006381333931').rotate(90, expand=True)
+        self.assertEqual(decode.decode(image), ['4006381333931'])
+        self.assertEqual(decode.decode(image.rotate(180)), ['4006381333931'])
+
+    def test_no_barcode(self):
+        from PIL import Image
+        blank = Image.new('L', (300, 60), 255)
+        self.assertEqual(decode.decode_source(png(blank)), ([], None))
+
+    def test_not_an_image(self):
+        eans, error = decode.decode_source(b'not an image')
+        self.assertEqual(eans, [])
+        self.assertIsNotNone(error)
+
+
+@skipUnless(decode.AVAILABLE, "Decoding barcodes needs NumPy and Pillow")
+@override_settings(INTERFACE_DECODE_PROCESSES=2)
+class DecodeViewTests(TestCase):
+    def setUp(self):
+        self.client.force_login(
+            get_user_model().objects.create_user('decode'))
+
+    def upload(self, *images):
+        return self.client.post(reverse('interface:decode'), {
+            'images': [SimpleUploadedFile(f'{ean}.png', content)
+                       for (ean, content) in images],
+        })
+
+    def test_images(self):
+        images = [(ean, png(barcode_image(ean)))
+                  for ean in ('4006381333931', '96385074')]
+        response = self.upload(*images)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            [[found['ean'] for found in result['eans']]
+             for result in response.json()['results']],
+            [['4006381333931'], ['96385074']])
+
+    def test_crashed_worker(self):
+        executor = decode.shared_executor()
+        # Kill a worker, which breaks the pool
+        executor.submit(os._exit, 1).exception()
+        images = [(ean, png(barcode_image(ean)))
+                  for ean in ('4006381333931', '96385074')]
+        response = self.upload(*images)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.json()['results'][0]['eans']), 1)
+        self.assertIsNot(decode.shared_executor(), executor)
+
+    @override_settings(INTERFACE_DECODE_MAX_IMAGES=1)
+    def test_too_many_images(self):
+        content = png(barcode_image('96385074'))
+        response = self.upload(('a', content), ('b', content))
+        self.assertEqual(response.status_code, 400)
+
+    @override_settings(INTERFACE_DECODE_MAX_IMAGE_SIZE=100)
+    def test_image_too_large(self):
+        response = self.upload(('a', png(barcode_image('4006381333931'))))
+        self.assertEqual(response.status_code, 413)
+
+
+class BrandPrefixTests(TestCase):
+    def setUp(self):
+        self.brand = Brand.objects.create(name="Brand")
+        self.product = Product.objects.create(brand=self.brand, name="P")
+        Packaging.objects.create(label='4006381333931', product=self.product)
+
+    def prefixes(self):
+        return set(BrandPrefix.objects.values_list('prefix', 'brand'))
+
+    def test_refresh_is_idempotent(self):
+        BrandPrefix.refresh('4006381')
+        BrandPrefix.refresh('4006381')
+        self.assertEqual(self.prefixes(), {('4006381', self.brand.pk)})
+
+    def test_move_product_to_other_brand(self):
+        other = Brand.objects.create(name="Other")
+        self.product.brand = other
+        self.product.save()
+        self.assertEqual(self.prefixes(), {('4006381', other.pk)})
+        self.assertEqual(Brand.by_ean('4006381000007'), other)
+
+
+@override_settings(STATICFILES_STORAGE=(
+    'django.contrib.staticfiles.storage.StaticFilesStorage'))
+class ShardTests(TestCase):
+    def setUp(self):
+        self.generic = GenericProduct.objects.create(name="Generic")
+        self.product = Product.objects.create(
+            brand=Brand.objects.create(name="Brand"), name="P",
+            generic_product=self.generic, count=3, count_shards=2)
+
+    def counts(self):
+        self.product.refresh_from_db()
+        self.generic.refresh_from_db()
+        return (self.product.count, Product.live_count(self.product.pk),
+                self.generic.stock)
+
+    def test_shard_is_folded(self):
+        self.assertEqual(Product.adjust_count(self.product.pk, 4, shard=1), 7)
+        self.assertEqual(self.counts(), (3, 7, 3))
+        self.assertEqual(Product.fold_counts(), 1)
+        self.assertEqual(self.counts(), (7, 7, 7))
+
+    def test_subtract_more_than_product_row(self):
+        Product.adjust_count(self.product.pk, 4, shard=0)
+        self.assertEqual(Product.adjust_count(self.product.pk, -5), 2)
+        self.assertEqual(self.counts(), (2, 2, 2))
+        self.assertIsNone(Product.adjust_count(self.product.pk, -3))
+
+    def test_missing_shard_updates_product(self):
+        self.assertEqual(Product.adjust_count(self.product.pk, 1, shard=5), 4)
+        self.assertEqual(self.counts(), (4, 4, 4))
+
+    def test_resize(self):
+        Product.adjust_count(self.product.pk, 4, shard=1)
+        self.product.count_shards = 1
+        self.product.save()
+        self.assertEqual(list(self.product.shards.values_list('index',
+                                                              flat=True)),
+                         [0])
+        self.assertEqual(self.counts(), (7, 7, 7))
+
+    def test_export_live_count(self):
+        Product.adjust_count(self.product.pk, 4, shard=1)
+        self.assertEqual([row[3] for row in catalog.export_rows()], [7])
+
+    def test_admin_live_count(self):
+        Product.adjust_count(self.product.pk, 4, shard=1)
+        self.client.force_login(get_user_model().objects.create_superuser(
+            'admin', 'admin@example.com', 'admin'))
+        response = self.client.get(
+            reverse('admin:interface_product_changelist'))
+        self.assertContains(response, '<td class="field-live_count">7</td>',
+                            html=True)
+
+
+class StocktakeViewTests(TestCase):
+    def test_anonymous_is_redirected_before_lookup(self):
+        url = reverse('interface:stocktake', kwargs={'pk': 1})
+        with self.assertNumQueries(0):
+            response = self.client.get(url)
+        self.assertRedirects(response, f'{reverse("login")}?next={url}',
+                             fetch_redirect_response=False)
+
+    def test_missing_stocktake(self):
+        self.client.force_login(get_user_model().objects.create_user('u'))
+        response = self.client.get(
+            reverse('interface:stocktake', kwargs={'pk': 1}))
+        self.assertEqual(response.status_code, 404)
+
+
+class GenericStockTests(TestCase):
+    def setUp(self):
+        self.brand = Brand.objects.create(name="Brand")
+        self.generic = GenericProduct.objects.create(name="Generic")
+        self.other = GenericProduct.objects.create(name="Other")
+        self.product = Product.objects.create(
+            brand=self.brand, name="P", generic_product=self.generic,
+            count=3)
+
+    def stock(self):
+        return dict(GenericProduct.objects.values_list('name', 'stock'))
+
+    def test_created_and_adjusted(self):
+        self.assertEqual(self.stock(), {"Generic": 3, "Other": 0})
+        Product.adjust_count(self.product.pk, 2)
+        self.assertEqual(self.stock(), {"Generic": 5, "Other": 0})
+
+    def test_save_stale_instance(self):
+        Product.adjust_count(self.product.pk, 2)
+        # self.product still has count 3
+        self.product.generic_product = self.other
+        self.product.save()
+        self.assertEqual(self.stock(), {"Generic": 0, "Other": 5})
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.count, 5)
+
+    def test_delete(self):
+        Product.objects.create(brand=self.brand, name="Q",
+                               generic_product=self.generic, count=4)
+        self.product.delete()
+        self.assertEqual(self.stock(), {"Generic": 4, "Other": 0})
+
+    def test_reconcile(self):
+        GenericProduct.objects.filter(pk=self.generic.pk).update(stock=10)
+        GenericProduct.objects.filter(pk=self.other.pk).update(stock=-1)
+        self.assertEqual(GenericProduct.reconcile(), 2)
+        self.assertEqual(self.stock(), {"Generic": 3, "Other": 0})
+        self.assertEqual(GenericProduct.reconcile(), 0)
+
+
+class AdjustCountTests(TestCase):
+    def setUp(self):
+        self.generic = GenericProduct.objects.create(name="Generic")
+        self.product = Product.objects.create(
+            brand=Brand.objects.create(name="Brand"), name="P",
+            generic_product=self.generic, count=3)
+
+    def counts(self):
+        self.product.refresh_from_db()
+        self.generic.refresh_from_db()
+        return (self.product.count, self.generic.stock)
+
+    def test_adjust(self):
+        self.assertEqual(Product.adjust_count(self.product.pk, 2), 5)
+        self.assertEqual(Product.adjust_count(self.product.pk, -5), 0)
+        self.assertEqual(self.counts(), (0, 0))
+
+    def test_negative_count_is_rejected(self):
+        self.assertIsNone(Product.adjust_count(self.product.pk, -4))
+        self.assertEqual(self.counts(), (3, 3))
+
+    def test_missing_product(self):
+        self.assertIsNone(Product.adjust_count(self.product.pk + 1, 1))
+
+    def test_without_stock(self):
+        self.assertEqual(
+            Product.adjust_count(self.product.pk, 2, update_stock=False), 5)
+        self.assertEqual(self.counts(), (5, 3))
+
+
+class ApplyScansTests(TestCase):
+    def setUp(self):
+        self.generic = GenericProduct.objects.create(name="Generic")
+        self.product = Product.objects.create(
+            brand=Brand.objects.create(name="Brand"), name="P",
+            generic_product=self.generic, count=5)
+        Packaging.objects.create(label='4006381333931', product=self.product,
+                                 count=2)
+
+    def test_summed(self):
+        results = services.apply_scans([
+            ['4006381333931', 'add', 1],
+            {'ean': '4006381333931', 'action': 'subtract', 'quantity': 3},
+        ])
+        self.assertEqual([(r['status'], r['count']) for r in results],
+                         [('ok', 1), ('ok', 1)])
+        self.assertEqual(
+            list(StockMovement.objects.order_by('pk')
+                 .values_list('delta', flat=True)), [2, -6])
+
+    def test_partial_rejection(self):
+        results = services.apply_scans([
+            ['4006381333931', 'subtract', 2],
+            ['4006381333931', 'subtract', 2],
+            ['4006381333931', 'add', 1],
+        ])
+        self.assertEqual([r['status'] for r in results],
+                         ['ok', 'error', 'ok'])
+        self.assertEqual([r.get('count') for r in results], [1, None, 3])
+        self.generic.refresh_from_db()
+        self.assertEqual(self.generic.stock, 3)
+        self.assertEqual(
+            list(StockMovement.objects.order_by('pk')
+                 .values_list('delta', flat=True)), [-4, 2])
+
+    def test_unknown_and_invalid(self):
+        results = services.apply_scans([
+            ['96385074', 'add', 1],
+            ['4006381333931', 'steal', 1],
+            ['4006381333931', 'add', 1],
+        ])
+        self.assertEqual([r['status'] for r in results],
+                         ['unknown', 'invalid', 'ok'])
+        self.assertEqual(results[2]['count'], 7)
+
+
+class EANCacheTests(TransactionTestCase):
+    """Transactions are committed, so the invalidations run"""
+
+    def setUp(self):
+        ean_cache.clear()
+        product = Product.objects.create(
+            brand=Brand.objects.create(name="Brand"), name="P")
+        self.packaging = Packaging.objects.create(
+            label='4006381333931', product=product, count=2)
+
+    def test_invalidated_on_commit(self):
+        self.assertEqual(ean_cache.resolve('4006381333931').count, 2)
+        with transaction.atomic():
+            self.packaging.count = 6
+            self.packaging.save()
+            # Another request would cache the old row again
+            self.assertEqual(ean_cache.get('4006381333931').count, 2)
+        self.assertIsNone(ean_cache.get('4006381333931'))
+        self.assertEqual(ean_cache.resolve('4006381333931').count, 6)
+
+    def test_fresh(self):
+        ean_cache.set('4006381333931',
+                      Resolution(self.packaging.pk, 0, 12))
+        self.assertEqual(
+            ean_cache.resolve('4006381333931', fresh=True).count, 2)
+        self.assertEqual(ean_cache.get('4006381333931').count, 2)
+
+    def test_expired(self):
+        cache = EANCache(ttl=-1)
+        cache.set('4006381333931', Resolution(self.packaging.pk, 0, 12))
+        self.assertIsNone(cache.get('4006381333931'))
+
+
+class StockSnapshotTests(TestCase):
+    def setUp(self):
+        brand = Brand.objects.create(name="Brand")
+        # The snapshots follow the ledger, not the count
+        self.product = Product.objects.create(brand=brand, name="P",
+                                              count=100)
+        self.other = Product.objects.create(brand=brand, name="Q")
+        self.start = timezone.now() - timedelta(hours=3)
+
+    def move(self, delta, hours=None):
+        created_at = timezone.now()
+        if hours is not None:
+            created_at = self.start + timedelta(hours=hours)
+        return StockMovement.objects.create(
+            product=self.product, delta=delta, created_at=created_at)
+
+    def test_take(self):
+        self.move(3)
+        last = self.move(2)
+        self.assertEqual(StockSnapshot.take(), 1)
+        snapshot = StockSnapshot.objects.get()
+        self.assertEqual((snapshot.product, snapshot.count,
+                          snapshot.last_movement_id),
+                         (self.product, 5, last.pk))
+        self.assertEqual(StockSnapshot.take(), 0)
+        last = self.move(-1)
+        self.assertEqual(StockSnapshot.take(), 1)
+        self.assertEqual(
+            list(StockSnapshot.objects.order_by('pk')
+                 .values_list('count', 'last_movement_id')),
+            [(5, snapshot.last_movement_id), (4, last.pk)])
+
+    def test_stock_at(self):
+        self.move(3, hours=0)
+        self.move(2, hours=1)
+        StockSnapshot.take()
+        self.move(-1)
+        self.assertEqual(self.product.stock_at(self.start), 3)
+        self.assertEqual(
+            self.product.stock_at(self.start + timedelta(minutes=90)), 5)
+        self.assertEqual(self.product.stock_at(timezone.now()), 4)
+        self.assertEqual(self.other.stock_at(timezone.now()), 0)
+
+    def test_stock_at_starts_from_snapshot(self):
+        self.move(3, hours=0)
+        StockSnapshot.take()
+        self.move(-1)
+        StockSnapshot.objects.update(count=50)
+        self.assertEqual(self.product.stock_at(timezone.now()), 49)
+
+
+@override_settings(STATICFILES_STORAGE=(
+    'django.contrib.staticfiles.storage.StaticFilesStorage'))
+class ConditionalGetTests(TestCase):
+    def setUp(self):
+        ean_cache.clear()
+        autocomplete_cache.clear()
+        generic = GenericProduct.objects.create(name="Generic")
+        brand = Brand.objects.create(name="Brand")
+        self.product = Product.objects.create(
+            brand=brand, name="P", generic_product=generic, count=3)
+        self.alternative = Product.objects.create(
+            brand=brand, name="Q", generic_product=generic, count_shards=1)
+        Packaging.objects.create(label='4006381333931', product=self.product)
+        self.url = reverse('interface:packaging',
+                           kwargs={'ean': '4006381333931'})
+        self.client.force_login(get_user_model().objects.create_user('u'))
+        # Set the CSRF cookie, which is part of the ETag
+        self.client.get(self.url)
+
+    def assertNotModified(self, url, modify=None):
+        etag = self.client.get(url)['ETag']
+        self.assertEqual(
+            self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+        if modify is not None:
+            modify()
+            self.assertEqual(
+                self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code,
+                200)
+
+    def test_count_changed(self):
+        self.assertNotModified(
+            self.url, lambda: Product.adjust_count(self.product.pk, 1))
+
+    def test_alternative_shard_changed(self):
+        self.assertNotModified(
+            self.url,
+            lambda: Product.adjust_count(self.alternative.pk, 1, shard=0))
+
+    def test_catalog_changed(self):
+        def rename():
+            self.product.name = "R"
+            self.product.save()
+        self.assertNotModified(self.url, rename)
+
+    def test_messages_are_not_hidden(self):
+        Product.adjust_count(self.product.pk, -3)
+        etag = self.client.get(self.url)['ETag']
+        # Changes nothing but adds a message
+        self.client.post(self.url, {'action': 'subtract'})
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertContains(response, "We can&#x27;t have negative counts!")
+
+    def test_autocomplete(self):
+        self.assertNotModified(
+            reverse('interface:brand-autocomplete') + '?q=b',
+            lambda: Brand.objects.create(name="Bread"))
+
+
+class AutocompleteCacheTests(TestCase):
+    def setUp(self):
+        self.cache = AutocompleteCache(fetch_limit=4)
+        self.names = ["koffie", "kokos", "kaas", "thee"]
+        self.searches = []
+
+    def search(self, query, limit):
+        self.searches.append(query)
+        return [name for name in self.names if name.startswith(query)][:limit]
+
+    def results(self, query, version=1, limit=20):
+        return self.cache.results(
+            ('scope',), query, version, self.search,
+            lambda query, name: name.startswith(query), limit)
+
+    def test_narrowed(self):
+        self.assertEqual(self.results("k"), ["koffie", "kokos", "kaas"])
+        self.assertEqual(self.searches, ["k"])
+        self.names.remove("kaas")
+        # The complete results for "k" are filtered instead
+        self.assertEqual(self.results("Ko"), ["koffie", "kokos"])
+        self.assertEqual(self.results("kof"), ["koffie"])
+        self.assertEqual(self.searches, ["k"])
+        self.assertEqual(self.cache.stats()['narrowed'], 2)
+        self.assertEqual(self.results("ko", limit=1), ["koffie"])
+        self.assertEqual(self.cache.stats()['hits'], 1)
+
+    def test_incomplete_results_are_not_narrowed(self):
+        self.names = ["k1", "k2", "k3", "k4", "k5"]
+        self.assertEqual(self.results("k"), ["k1", "k2", "k3", "k4"])
+        self.assertEqual(self.results("k5"), ["k5"])
+        self.assertEqual(self.searches, ["k", "k5"])
+
+    def test_catalog_changed(self):
+        self.results("k")
+        self.results("ko", version=2)
+        self.assertEqual(self.searches, ["k", "ko"])
+
+
+class ProductAutocompleteTests(TestCase):
+    def setUp(self):
+        autocomplete_cache.clear()
+        brand = Brand.objects.create(name="Merk")
+        for name in ["Koffie", "Kokos", "Kaas", "Thee"]:
+            Product.objects.create(brand=brand, name=name)
+        self.client.force_login(get_user_model().objects.create_user('u'))
+
+    def names(self, query):
+        response = self.client.get(
+            reverse('interface:product-autocomplete'), {'q': query})
+        return sorted(result['text'] for result in response.json()['results'])
+
+    def test_narrowed(self):
+        self.assertEqual(self.names("k"),
+                         ["Merk Kaas", "Merk Koffie", "Merk Kokos"])
+        self.assertEqual(self.names("ko"), ["Merk Koffie", "Merk Kokos"])
+        self.assertEqual(autocomplete_cache.stats()['narrowed'], 1)
+
+    def test_catalog_changed(self):
+        self.names("ko")
+        Product.objects.create(brand=Brand.objects.get(), name="Kolen")
+        self.assertEqual(self.names("ko"),
+                         ["Merk Koffie", "Merk Kokos", "Merk Kolen"])
@@ -16,6 +16,36 @@ urlpatterns = [
     path('packaging/ean/<str:ean>/',
          views.PackagingView.as_view(),
          name='packaging'),
+    path('packaging/batch/',
+         views.BatchScanView.as_view(),
+         name='batch_scan'),
+    path('decode/',
+         views.DecodeView.as_view(),
+         name='decode'),
+    path('stocktake/',
+         views.CreateStocktakeView.as_view(),
+         name='create_stocktake'),
+    path('stocktake/<int:pk>/',
+         views.StocktakeView.as_view(),
+         name='stocktake'),
+    path('stocktake/<int:pk>/commit/',
+         views.CommitStocktakeView.as_view(),
+         name='commit_stocktake'),
+    path('reorder/',
+         views.ReorderView.as_view(),
+         name='reorder'),
+    path('events/',
+         views.EventsView.as_view(),
+         name='events'),
+    path('catalog/sync/',
+         views.CatalogSyncView.as_view(),
+         name='catalog_sync'),
+    path('export/',
+         views.ExportView.as_view(),
+         name='export'),
+    path('metrics/',
+         views.MetricsView.as_view(),
+         name='metrics'),
 
     # Autocomplete forms
     path('autocomplete/brand_autocomplete',
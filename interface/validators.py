@@ -1,8 +1,9 @@
-import stdnum.ean
 import stdnum.exceptions
 from django.core.exceptions import ValidationError
 from django.utils.deconstruct import deconstructible
 
+from interface import ean
+
 
 @deconstructible
 def ean_validator(value):
@@ -16,6 +17,6 @@ def ean_validator(value):
         >>> ean_validator('8718265638716')
     """
     try:
-        stdnum.ean.validate(value)
+        ean.validate(value)
     except stdnum.exceptions.ValidationError as e:
         raise ValidationError(e.message) from e
@@ -1,57 +1,390 @@
+import hashlib
+import json
+from concurrent.futures.process import BrokenProcessPool
+from urllib.parse import urlencode
+
 from dal import autocomplete
+from django.conf import settings
 from django.contrib import messages
-from django.contrib.auth.mixins import LoginRequiredMixin
+from django.contrib.auth.mixins import LoginRequiredMixin, UserPassesTestMixin
 from django.core.exceptions import ValidationError
-from django.db.models import Q
-from django.http import HttpResponseBadRequest
+from django.db import transaction
+from django.db.models import F, OuterRef, Subquery, Sum
+from django.http import (Http404, HttpResponse, HttpResponseBadRequest,
+                         JsonResponse, StreamingHttpResponse)
 from django.shortcuts import get_object_or_404, redirect, render
 from django.urls import reverse, reverse_lazy
+from django.utils.decorators import method_decorator
+from django.utils.functional import cached_property
 from django.views import View
+from django.views.decorators.cache import cache_control
+from django.views.decorators.http import condition
 from django.views.generic.edit import CreateView, FormView
 
-from interface import forms
-from interface.models import Brand, GenericProduct, Packaging, Product
+from interface import (catalog, decode, events, forms, metrics, search,
+                       services)
+from interface.cache import autocomplete_cache, ean_cache
+from interface.models import (Brand, CatalogVersion, GenericProduct,
+                              Packaging, Product, ProductCountShard,
+                              StockMovement, Stocktake, StocktakeScan)
+
+
+def resolve_or_404(ean, fresh=False):
+    try:
+        return ean_cache.resolve(ean, fresh)
+    except Packaging.DoesNotExist as e:
+        raise Http404(f"No packaging with EAN {ean}") from e
+
+
+def _etag(*parts):
+    return hashlib.md5(':'.join(map(str, parts)).encode()).hexdigest()
+
+
+def _last_catalog_change(request):
+    """:meth:`CatalogVersion.last_change`, once per request"""
+    if not hasattr(request, '_last_catalog_change'):
+        request._last_catalog_change = CatalogVersion.last_change()
+    return request._last_catalog_change
+
+
+def packaging_etag(request, ean):
+    """
+    Version of a packaging page: the catalog version, the count of the
+    product, the stock version of its generic product and the number of
+    shard updates of its alternatives.
+
+    The page contains a CSRF token, so this is also specific to the user
+    and their CSRF cookie.
+    """
+    if len(messages.get_messages(request)):
+        # Don't hide the messages of the last POST behind a 304
+        return None
+    try:
+        resolution = ean_cache.resolve(ean)
+    except Packaging.DoesNotExist:
+        return None
+    shard_updates = (
+        ProductCountShard.objects
+        .filter(product__generic_product=OuterRef('generic_product'))
+        .values('product__generic_product').annotate(total=Sum('updates'))
+        .values('total'))
+    # A single query, including the catalog version
+    stock = (Product.with_live_count().filter(pk=resolution.product)
+             .annotate(shard_updates=Subquery(shard_updates),
+                       current_catalog_version=Subquery(
+                           CatalogVersion.objects.filter(pk=1)
+                           .values('value')))
+             .values_list('current_catalog_version', 'live_count',
+                          'generic_product__stock_version', 'shard_updates')
+             .first())
+    if stock is None:
+        return None
+    return _etag(resolution.packaging, *stock, request.user.pk,
+                 request.COOKIES.get(settings.CSRF_COOKIE_NAME))
+
+
+def autocomplete_etag(request, *args, **kwargs):
+    """
+    Version of autocomplete results: the catalog version, and the user,
+    who may be allowed to create new objects.
+    """
+    return _etag(_last_catalog_change(request)[0], request.user.pk)
+
+
+def autocomplete_last_modified(request, *args, **kwargs):
+    return _last_catalog_change(request)[1]
+
+
+class ConditionalAutocompleteMixin:
+    """
+    Answer autocomplete requests with 304 Not Modified if the catalog did
+    not change.
+
+    The results may be cached by proxies, which check with us before using
+    them. Sessions add ``Vary: Cookie``, so each user gets their own.
+    """
+
+    @method_decorator(cache_control(public=True, no_cache=True))
+    @method_decorator(condition(etag_func=autocomplete_etag,
+                                last_modified_func=autocomplete_last_modified))
+    def get(self, request, *args, **kwargs):
+        return super().get(request, *args, **kwargs)
 
 
 class PackagingView(LoginRequiredMixin, View):
+    #: Maximum number of alternatives for the generic product to show
+    max_alternatives = 25
+
+    @method_decorator(cache_control(private=True, no_cache=True))
+    @method_decorator(condition(etag_func=packaging_etag))
     def get(self, request, ean):
-        packaging = get_object_or_404(Packaging, label=ean)
+        packaging = get_object_or_404(
+            Packaging.objects.select_related(
+                'product__brand', 'product__generic_product'),
+            pk=resolve_or_404(ean).packaging)
+        product = packaging.product
 
+        alternatives = []
+        if product.generic_product_id is not None:
+            alternatives = list(
+                Product.with_live_count()
+                .filter(generic_product=product.generic_product_id)
+                .select_related('brand')
+                .annotate(ean=Subquery(
+                    Packaging.objects.filter(product=OuterRef('pk'))
+                    .order_by('pk').values('label')[:1]))
+                .order_by('brand__name', 'name')
+                [:self.max_alternatives + 1])
+
+        more_alternatives = len(alternatives) > self.max_alternatives
+        alternatives = alternatives[:self.max_alternatives]
+        # The product itself is usually one of the alternatives
+        products = dict.fromkeys(
+            [product.pk] + [alternative.pk for alternative in alternatives])
         return render(request, 'interface/packaging_view.html', {
             'packaging': packaging,
-            'product': packaging.product,
+            'product': product,
+            'count': (Product.live_count(product.pk) if product.count_shards
+                      else product.count),
+            'alternatives': alternatives,
+            'more_alternatives': more_alternatives,
+            'events_url': reverse('interface:events') + '?' + urlencode(
+                [('product', pk) for pk in products]),
         })
 
     def post(self, request, ean):
-        packaging = get_object_or_404(Packaging, label=ean)
+        # Another process may have changed the packaging, don't count the
+        # scan for the wrong product
+        packaging = resolve_or_404(ean, fresh=True)
         action = request.POST.get('action')
         if action not in ('add', 'subtract'):
             return HttpResponseBadRequest(f"bad action: {action!r}")
-        product = packaging.product
         if action == 'add':
-            product.count += packaging.count
+            delta = packaging.count
         else:
-            product.count -= packaging.count
-        try:
-            product.save()
-        except ValidationError:
-            messages.error(request, "We can't have negative counts!")
+            delta = -packaging.count
+        shard = None
+        if packaging.shards:
+            # Stations that scan the same busy product update different rows
+            shard = Product.pick_shard(packaging.shards,
+                                       request.session.session_key)
+        with transaction.atomic():
+            count = Product.adjust_count(packaging.product, delta,
+                                         shard=shard)
+            if count is None:
+                messages.error(request, "We can't have negative counts!")
+            else:
+                transaction.on_commit(
+                    lambda: events.hub.publish(packaging.product, count))
+                StockMovement.objects.create(
+                    product_id=packaging.product,
+                    packaging_id=packaging.packaging,
+                    delta=delta,
+                    user=request.user,
+                )
 
         return redirect(reverse('interface:packaging', kwargs={'ean': ean}))
 
 
+def scan_url(ean):
+    """Where to go after scanning ``ean``"""
+    try:
+        ean_cache.resolve(ean)
+    except Packaging.DoesNotExist:
+        return reverse('interface:select_product_for_packaging',
+                       kwargs={'ean': ean})
+    return reverse('interface:packaging', kwargs={'ean': ean})
+
+
 class ScannerView(LoginRequiredMixin, FormView):
     form_class = forms.ProductScannerForm
     template_name = 'interface/index.html'
 
+    def form_valid(self, form):
+        return redirect(scan_url(form.cleaned_data['ean']))
+
+
+class DecodeView(LoginRequiredMixin, View):
+    """
+    Decode the barcodes in the uploaded ``images``.
+
+    Returns per image the EANs found, with the URL :class:`ScannerView`
+    would go to for them.
+    """
+
+    def post(self, request):
+        if not decode.AVAILABLE:
+            return HttpResponse("Decoding barcodes needs NumPy and Pillow",
+                                status=501, content_type='text/plain')
+        images = request.FILES.getlist('images')
+        if not images:
+            return HttpResponseBadRequest("no images")
+        max_images = getattr(settings, 'INTERFACE_DECODE_MAX_IMAGES', 20)
+        if len(images) > max_images:
+            return HttpResponseBadRequest(
+                f"at most {max_images} images per request")
+        max_size = getattr(settings, 'INTERFACE_DECODE_MAX_IMAGE_SIZE',
+                           10 * 1024 * 1024)
+        for image in images:
+            if image.size > max_size:
+                return HttpResponse(
+                    f"{image.name} is larger than {max_size} bytes",
+                    status=413, content_type='text/plain')
+
+        if len(images) == 1:
+            decoded = [decode.decode_source(images[0].read())]
+        else:
+            decoded = self.decode_many([image.read() for image in images])
+            if decoded is None:
+                return HttpResponse("Decoding failed, try again",
+                                    status=503, content_type='text/plain')
+
+        results = []
+        for (image, (eans, error)) in zip(images, decoded):
+            result = {
+                'image': image.name,
+                'eans': [{'ean': ean, 'url': scan_url(ean)} for ean in eans],
+            }
+            if error is not None:
+                result['error'] = error
+            results.append(result)
+        return JsonResponse({'results': results})
+
+    def decode_many(self, contents):
+        """
+        Decode ``contents`` in the shared pool. If a worker crashed, retry
+        once in a new pool, and return ``None`` if that fails too.
+        """
+        for _ in range(2):
+            executor = decode.shared_executor(
+                getattr(settings, 'INTERFACE_DECODE_PROCESSES', None))
+            try:
+                return list(decode.decode_many(contents, executor=executor))
+            except BrokenProcessPool:
+                decode.reset_shared_executor(executor)
+        return None
+
+
+class BatchScanView(LoginRequiredMixin, View):
+    """
+    Apply a batch of buffered scans in one request.
+
+    Expects a JSON body like ``{"scans": [{"ean": "...", "action": "add",
+    "quantity": 1}, ...]}``, where ``scans`` may also contain
+    ``[ean, action, quantity]`` lists.
+    """
+    def post(self, request):
+        try:
+            scans = json.loads(request.body)['scans']
+        except (ValueError, TypeError, KeyError):
+            return HttpResponseBadRequest("expected a JSON object with scans")
+        if not isinstance(scans, list):
+            return HttpResponseBadRequest("scans should be a list")
+
+        return JsonResponse({
+            'results': services.apply_scans(scans, user=request.user),
+        })
+
+
+class CreateStocktakeView(LoginRequiredMixin, CreateView):
+    model = Stocktake
+    fields = ['full']
+
+    def form_valid(self, form):
+        form.instance.user = self.request.user
+        return super().form_valid(form)
+
+    def get_success_url(self):
+        return reverse('interface:stocktake', kwargs={'pk': self.object.pk})
+
+
+class StocktakeView(LoginRequiredMixin, FormView):
+    """Record scans for a stocktake, without changing any counts"""
+    form_class = forms.StocktakeScanForm
+    template_name = 'interface/stocktake.html'
+
+    @cached_property
+    def stocktake(self):
+        # Not in dispatch, so anonymous users are redirected before a lookup
+        return get_object_or_404(Stocktake, pk=self.kwargs['pk'])
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        context['stocktake'] = self.stocktake
+        context['scans'] = self.stocktake.scans.count()
+        return context
+
     def form_valid(self, form):
         ean = form.cleaned_data['ean']
+        if self.stocktake.committed_at is not None:
+            messages.error(self.request,
+                           "This stocktake was already committed")
+            return redirect(self.request.path)
+        try:
+            packaging = ean_cache.resolve(ean)
+        except Packaging.DoesNotExist:
+            messages.error(self.request, f"Unknown EAN {ean}")
+            return redirect(self.request.path)
+
+        StocktakeScan.objects.create(
+            stocktake=self.stocktake,
+            packaging_id=packaging.packaging,
+            quantity=form.cleaned_data['quantity'],
+        )
+        return redirect(self.request.path)
+
+
+class CommitStocktakeView(LoginRequiredMixin, View):
+    template_name = 'interface/stocktake_commit.html'
+
+    def get(self, request, pk):
+        stocktake = get_object_or_404(Stocktake, pk=pk)
+        discrepancies = stocktake.discrepancies()
+        products = Product.objects.select_related('brand').in_bulk(
+            [pk for (pk, _, _) in discrepancies])
+        return render(request, self.template_name, {
+            'stocktake': stocktake,
+            'discrepancies': [
+                (products[pk], count, counted)
+                for (pk, count, counted) in discrepancies
+            ],
+        })
+
+    def post(self, request, pk):
+        stocktake = get_object_or_404(Stocktake, pk=pk)
         try:
-            Product.by_ean(ean)
-        except Product.DoesNotExist:
-            return redirect('interface:select_product_for_packaging', ean=ean)
+            corrected = stocktake.commit(user=request.user)
+        except ValidationError as e:
+            messages.error(request, e.messages[0])
+            return redirect('interface:stocktake', pk=pk)
+        messages.success(request, f"Corrected {corrected} products")
+        return redirect('interface:index')
 
-        return redirect('interface:packaging', ean=ean)
+
+class ReorderView(LoginRequiredMixin, View):
+    """
+    Generic products of which the stock is below their reorder level, or
+    below the ``threshold`` query parameter if it is given.
+    """
+
+    def get(self, request):
+        threshold = request.GET.get('threshold')
+        generic_products = GenericProduct.objects.all()
+        if threshold:
+            try:
+                threshold = int(threshold)
+            except ValueError:
+                return HttpResponseBadRequest(
+                    f"bad threshold: {threshold!r}")
+            generic_products = generic_products.filter(stock__lt=threshold)
+        else:
+            generic_products = generic_products.filter(
+                reorder_level__isnull=False, stock__lt=F('reorder_level'))
+
+        return render(request, 'interface/reorder.html', {
+            'generic_products': generic_products.order_by('stock', 'name'),
+            'threshold': threshold,
+        })
 
 
 class CreatePackagingView(LoginRequiredMixin, CreateView):
@@ -123,7 +456,20 @@ class SelectProductView(LoginRequiredMixin, View):
                     }))
 
 
-class BrandAutocompleteView(LoginRequiredMixin,
+def _cached_queryset(queryset, objects):
+    """
+    ``queryset`` restricted to ``objects``, in their order.
+
+    dal needs a queryset rather than a list, e.g. for its model when it
+    checks permissions. The objects are its result cache, so they are not
+    fetched again.
+    """
+    queryset = search.in_order(queryset, [obj.pk for obj in objects])
+    queryset._result_cache = list(objects)
+    return queryset
+
+
+class BrandAutocompleteView(LoginRequiredMixin, ConditionalAutocompleteMixin,
                             autocomplete.Select2QuerySetView):
     create_field = 'name'
 
@@ -135,23 +481,103 @@ class BrandAutocompleteView(LoginRequiredMixin,
 
 
 class ProductAutocompleteView(LoginRequiredMixin,
+                              ConditionalAutocompleteMixin,
                               autocomplete.Select2QuerySetView):
     def get_queryset(self):
-        qs = Product.objects.all().order_by('name')
         brand = self.forwarded.get('brand')
+        if self.q:
+            # dal calls this more than once per request
+            if not hasattr(self, '_results'):
+                self._results = _cached_queryset(
+                    Product.objects.select_related('brand'),
+                    autocomplete_cache.results(
+                        ('product', brand), self.q,
+                        _last_catalog_change(self.request)[0],
+                        lambda query, limit: search.search_products(
+                            query, brand=brand, limit=limit),
+                        search.product_matches, search.MAX_RESULTS))
+            return self._results
+        qs = Product.objects.select_related('brand').order_by('name')
         if brand:
             qs = qs.filter(brand=brand)
-        if self.q:
-            qs = qs.filter(
-                Q(name__icontains=self.q) | Q(brand__name__icontains=self.q))
         return qs
 
 
-class GenericProductAutocompleteView(autocomplete.Select2QuerySetView):
+class GenericProductAutocompleteView(ConditionalAutocompleteMixin,
+                                     autocomplete.Select2QuerySetView):
     create_field = 'name'
 
     def get_queryset(self):
-        qs = GenericProduct.objects.all()
         if self.q:
-            qs = qs.filter(name__icontains=self.q)
-        return qs
+            # dal calls this more than once per request
+            if not hasattr(self, '_results'):
+                self._results = _cached_queryset(
+                    GenericProduct.objects.all(),
+                    autocomplete_cache.results(
+                        ('generic_product',), self.q,
+                        _last_catalog_change(self.request)[0],
+                        search.search_generic_products,
+                        search.generic_product_matches,
+                        search.MAX_RESULTS))
+            return self._results
+        return GenericProduct.objects.all()
+
+
+class StaffRequiredMixin(UserPassesTestMixin):
+    def test_func(self):
+        return self.request.user.is_staff
+
+
+class CatalogSyncView(LoginRequiredMixin, View):
+    """
+    The catalog changes since the version in the ``since`` query parameter,
+    for scanners that resolve EANs themselves.
+
+    Without ``since``, this returns the whole catalog.
+    """
+
+    def get(self, request):
+        since = request.GET.get('since')
+        if since:
+            try:
+                since = int(since)
+            except ValueError:
+                return HttpResponseBadRequest(f"bad version: {since!r}")
+        else:
+            since = None
+        return JsonResponse(catalog.changes(since))
+
+
+class EventsView(LoginRequiredMixin, View):
+    """
+    Placeholder for the live count events, which are served by
+    :class:`interface.events.EventsApplication` under ASGI.
+    """
+
+    def get(self, request):
+        # Browsers don't reconnect after an error status
+        return HttpResponse("Live counts need the ASGI application",
+                            status=501, content_type='text/plain')
+
+
+class MetricsView(StaffRequiredMixin, View):
+    """Request metrics in the Prometheus text format, for staff only"""
+
+    def get(self, request):
+        return HttpResponse(metrics.aggregator.render(),
+                            content_type='text/plain; version=0.0.4')
+
+
+class ExportView(StaffRequiredMixin, View):
+    """Stream all products as CSV or JSONL, for staff only"""
+
+    def get(self, request):
+        format = request.GET.get('format', 'csv')
+        if format not in catalog.EXPORT_FORMATS:
+            return HttpResponseBadRequest(f"bad format: {format!r}")
+        writer, content_type = catalog.EXPORT_FORMATS[format]
+        response = StreamingHttpResponse(writer(catalog.export_rows()),
+                                         content_type=content_type)
+        response['Content-Disposition'] = (
+            f'attachment; filename="inventory.{format}"')
+        return response
@@ -0,0 +1,24 @@
+"""
+ASGI config for inventory project.
+
+It exposes the ASGI callable as a module-level variable named ``application``.
+
+The views are synchronous, so Django runs every request in its thread pool.
+Only the live count events are served without a thread per request.
+
+For more information on this file, see
+https://docs.djangoproject.com/en/3.0/howto/deployment/asgi/
+"""
+
+import os
+
+from django.core.asgi import get_asgi_application
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'inventory.settings')
+
+application = get_asgi_application()
+
+# Stream live counts without tying up a Django thread per open page
+from interface.events import EventsApplication  # noqa: E402
+
+application = EventsApplication(application)
@@ -12,6 +12,8 @@ https://docs.djangoproject.com/en/2.2/ref/settings/
 
 import os
 
+from django.core.exceptions import ImproperlyConfigured
+
 # Build paths inside the project like this: os.path.join(BASE_DIR, ...)
 BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 
@@ -75,17 +77,65 @@ TEMPLATES = [
     },
 ]
 
+# Per-view request metrics, served at /metrics/. See interface.metrics.
+if os.environ.get('INVENTORY_METRICS', '') == '1':
+    MIDDLEWARE.insert(0, 'interface.metrics.MetricsMiddleware')
+    TEMPLATES[0]['BACKEND'] = 'interface.metrics.TimedDjangoTemplates'
+
 WSGI_APPLICATION = 'inventory.wsgi.application'
 
 
 # Database
 # https://docs.djangoproject.com/en/2.2/ref/settings/#databases
 
-DATABASES = {
-    'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': os.path.join(BASE_DIR, 'db.sqlite3'),
+# Select the database with INVENTORY_DB_ENGINE ('sqlite' or 'postgresql').
+
+DATABASE_ENGINE = os.environ.get('INVENTORY_DB_ENGINE', 'sqlite')
+
+if DATABASE_ENGINE == 'postgresql':
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.postgresql',
+            'NAME': os.environ.get('INVENTORY_DB_NAME', 'inventory'),
+            'USER': os.environ.get('INVENTORY_DB_USER', ''),
+            'PASSWORD': os.environ.get('INVENTORY_DB_PASSWORD', ''),
+            'HOST': os.environ.get('INVENTORY_DB_HOST', ''),
+            'PORT': os.environ.get('INVENTORY_DB_PORT', ''),
+            # Keep connections open between requests
+            'CONN_MAX_AGE': int(
+                os.environ.get('INVENTORY_DB_CONN_MAX_AGE', 600)),
+            # Server-side cursors don't work through a pgbouncer in
+            # transaction pooling mode, so set this when using one.
+            'DISABLE_SERVER_SIDE_CURSORS': (
+                os.environ.get('INVENTORY_DB_POOLED', '') == '1'),
+        }
+    }
+elif DATABASE_ENGINE == 'sqlite':
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.sqlite3',
+            'NAME': os.environ.get(
+                'INVENTORY_DB_NAME', os.path.join(BASE_DIR, 'db.sqlite3')),
+            'CONN_MAX_AGE': int(
+                os.environ.get('INVENTORY_DB_CONN_MAX_AGE', 600)),
+            'OPTIONS': {
+                # Seconds to wait for the write lock. This sets SQLite's
+                # busy timeout, so it's not among the SQLITE_PRAGMAS
+                'timeout': 5,
+            },
+        }
     }
+else:
+    raise ImproperlyConfigured(
+        f"Unknown INVENTORY_DB_ENGINE {DATABASE_ENGINE!r}")
+
+# PRAGMAs set on every new SQLite connection, see interface.signals
+SQLITE_PRAGMAS = {
+    # Readers don't block the writer, and vice versa
+    'journal_mode': 'WAL',
+    # Safe in WAL mode, only the last commits can be lost on power loss
+    'synchronous': 'NORMAL',
+    'mmap_size': 256 * 1024 * 1024,
 }
 
 
@@ -126,3 +176,55 @@ USE_TZ = True
 # https://docs.djangoproject.com/en/2.2/howto/static-files/
 
 STATIC_URL = '/static/'
+
+# Where collectstatic puts the files for the web server, see the Caddyfile
+STATIC_ROOT = os.environ.get('INVENTORY_STATIC_ROOT',
+                             os.path.join(BASE_DIR, 'static'))
+
+# Fingerprinted names and precompressed variants, so browsers can cache the
+# files forever
+STATICFILES_STORAGE = 'interface.storage.CompressedManifestStaticFilesStorage'
+
+
+# EAN resolution cache
+
+# Number of EANs to keep in the in-process cache
+INTERFACE_EAN_CACHE_SIZE = 4096
+
+# Set to one of the CACHES to share the EAN cache between processes
+INTERFACE_EAN_CACHE_BACKEND = None
+
+# Seconds until cached EANs are looked up again, other processes don't see
+# the invalidations of the in-process cache
+INTERFACE_EAN_CACHE_TTL = 60
+
+
+# Autocomplete result cache
+
+# Number of queries to keep results for, per process
+INTERFACE_AUTOCOMPLETE_CACHE_SIZE = 256
+
+# Seconds to keep results
+INTERFACE_AUTOCOMPLETE_CACHE_TTL = 30
+
+
+# Decoding uploaded photos, see interface.decode
+
+# Maximal number of images and bytes per image of a request
+INTERFACE_DECODE_MAX_IMAGES = 20
+INTERFACE_DECODE_MAX_IMAGE_SIZE = 10 * 1024 * 1024
+
+# Worker processes shared by the requests, None for one per CPU
+INTERFACE_DECODE_PROCESSES = None
+
+
+# Live count events, served by inventory/asgi.py
+
+# Number of events to queue per open page before dropping the oldest
+INTERFACE_EVENTS_QUEUE_SIZE = 16
+
+# Seconds between keepalive comments on idle event streams
+INTERFACE_EVENTS_KEEPALIVE = 15
+
+# host:port of ./manage.py events_broker, to pass events between processes
+INTERFACE_EVENTS_BROKER = os.environ.get('INVENTORY_EVENTS_BROKER')